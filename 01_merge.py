@@ -2,60 +2,47 @@
 
 import os
 import sys
+import shutil
 import subprocess
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from core.counts import print_counts, tee_counts, write_counts
+from core.intermediate import data_path, output_args, unlink_stale, write_index
 
 
-def run(cmd, stdin=None, stdout=None):
-    """Run a command and fail hard if it errors."""
-    print("Running:", " ".join(cmd))
-    result = subprocess.run(cmd, stdin=stdin, stdout=stdout, check=False)
-    if result.returncode != 0:
-        sys.exit(result.returncode)
-    return result
+FILL_TAGS = "AF,TYPE,AC,AC_Het,F_MISSING,MAF,HWE"
 
 
-def main():
-    if len(sys.argv) < 2:
-        print(f"Usage: {sys.argv[0]} <base_path>")
-        sys.exit(1)
+def merge_chain(vcfs, flags, out_path, region=None, out_format=(), counts=None):
+    """Run bcftools merge | norm | annotate | +fill-tags into ``out_path``.
 
-    base_path = Path(sys.argv[1])
-    missing_to_ref = os.environ.get("MISSING_TO_REF", "true").lower() == "true"
-
-    in_path = base_path / "00_raw_vcf"
-    out_path = base_path / "01_merged" / "data.vcf"
-
-    vcfs = sorted(in_path.glob("*.vcf"))
-    if not vcfs:
-        print(f"No VCFs found in {in_path}")
-        sys.exit(1)
-
-    flags = ["--missing-to-ref"] if missing_to_ref else []
-    print(f"Merge flags: {' '.join(flags) if flags else '(none)'}")
-
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-
-    print("Merging VCF files...")
+    ``out_format`` holds the final writer's format options. A ``counts``
+    dict is filled with the totals of the written stream. With a
+    ``region`` the inputs must be indexed and only records starting inside
+    it are kept. Region shards leave out the bcftools command lines so
+    their headers match for ``concat --naive``.
+    """
+    merge = ["bcftools", "merge", "--force-single"]
+    extra = []
+    if region is None:
+        merge.append("--force-no-index")
+    else:
+        merge += ["-r", region, "--regions-overlap", "0"]
+        extra = ["--no-version"]
 
     p1 = subprocess.Popen(
-        [
-            "bcftools",
-            "merge",
-            "--force-single",
-            "--force-no-index",
-            *flags,
-            *map(str, vcfs),
-        ],
+        [*merge, *extra, *flags, *map(str, vcfs)],
         stdout=subprocess.PIPE,
     )
 
     p2 = subprocess.Popen(
-        ["bcftools", "norm", "-m", "-any", "-"], stdin=p1.stdout, stdout=subprocess.PIPE
+        ["bcftools", "norm", *extra, "-m", "-any", "-"],
+        stdin=p1.stdout,
+        stdout=subprocess.PIPE,
     )
 
     p3 = subprocess.Popen(
-        ["bcftools", "annotate", "--set-id", "%CHROM-%POS-%REF-%ALT"],
+        ["bcftools", "annotate", *extra, "--set-id", "%CHROM-%POS-%REF-%ALT"],
         stdin=p2.stdout,
         stdout=subprocess.PIPE,
     )
@@ -64,21 +51,195 @@ def main():
         [
             "bcftools",
             "+fill-tags",
-            "-o",
-            str(out_path),
+            *extra,
+            *out_format,
+            *(["-o", str(out_path)] if counts is None else []),
             "--",
             "-t",
-            "AF,TYPE,AC,AC_Het,F_MISSING,MAF,HWE",
+            FILL_TAGS,
         ],
         stdin=p3.stdout,
+        stdout=None if counts is None else subprocess.PIPE,
+    )
+
+    # close our copies so an early exit downstream is seen upstream
+    for p in (p1, p2, p3):
+        p.stdout.close()
+
+    if counts is not None:
+        counts.update(tee_counts(p4.stdout, out_path))
+
+    return all(p.wait() == 0 for p in (p1, p2, p3, p4))
+
+
+def is_bgzf(path):
+    """Whether ``path`` is BGZF-compressed (bgzipped VCF or BCF)."""
+    with open(path, "rb") as f:
+        header = f.read(14)
+    return header[:4] == b"\x1f\x8b\x08\x04" and header[12:14] == b"BC"
+
+
+def index_input(vcf, index_dir):
+    """Indexed path of one input.
+
+    Inputs that are already bgzipped are indexed in place, keeping an
+    existing CSI/TBI index while it is newer than the file; others get a
+    bgzip + CSI copy in ``index_dir``.
+    """
+    if is_bgzf(vcf):
+        indexes = [Path(f"{vcf}.csi"), Path(f"{vcf}.tbi")]
+        if not any(
+            index.exists() and index.stat().st_mtime >= vcf.stat().st_mtime
+            for index in indexes
+        ):
+            subprocess.run(["bcftools", "index", "-f", str(vcf)], check=True)
+        return vcf
+
+    bgz_path = index_dir / f"{vcf.name}.gz"
+    subprocess.run(
+        ["bcftools", "view", "--no-version", "-Oz", "-o", str(bgz_path), str(vcf)],
+        check=True,
     )
+    subprocess.run(["bcftools", "index", "-f", str(bgz_path)], check=True)
+    return bgz_path
+
+
+def merge_regions(indexed, region_size):
+    """Contigs with records in any input, or windows of ``region_size`` bp.
+
+    Contigs keep their first-seen order so the shards concatenate in the
+    same order a whole-genome merge would write them.
+    """
+    lengths = {}
+    for path in indexed:
+        stats = subprocess.run(
+            ["bcftools", "index", "-s", str(path)],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        for line in stats.splitlines():
+            contig, length = line.split("\t")[:2]
+            length = int(length) if length.isdigit() else 0
+            lengths[contig] = max(lengths.get(contig, 0), length)
+
+    regions = []
+    for contig, length in lengths.items():
+        if not region_size or not length:
+            regions.append(contig)
+            continue
+        for start in range(1, length + 1, region_size):
+            regions.append(f"{contig}:{start}-{min(start + region_size - 1, length)}")
+    return regions
+
+
+def merge_shard(indexed, flags, shard_path, region):
+    if not merge_chain(indexed, flags, shard_path, region, out_format=["-Ob"]):
+        raise RuntimeError(f"Merging region {region} failed")
+    return shard_path
+
+
+def merge_sharded(vcfs, flags, out_path, workers, region_size, out_format=()):
+    """Merge region by region in a process pool and concatenate the shards.
+
+    ``out_format`` holds the concat writer's options, as for merge_chain.
+    Returns the totals counted while the joined stream is written.
+    """
+    index_dir = out_path.parent / "indexed"
+    shard_dir = out_path.parent / "shards"
+    index_dir.mkdir(exist_ok=True)
+    shard_dir.mkdir(exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        print(f"Indexing {len(vcfs)} input VCFs...")
+        indexed = list(pool.map(index_input, vcfs, [index_dir] * len(vcfs)))
+
+        regions = merge_regions(indexed, region_size)
+        print(f"Merging {len(regions)} regions with {workers} workers...")
+        shards = [shard_dir / f"{i:05d}.bcf" for i in range(len(regions))]
+        list(
+            pool.map(
+                merge_shard,
+                [indexed] * len(regions),
+                [flags] * len(regions),
+                shards,
+                regions,
+            )
+        )
+
+    # shards share one header, so their BGZF blocks can be joined as-is
+    print("Concatenating shards...")
+    procs = [
+        subprocess.Popen(
+            ["bcftools", "concat", "--naive", *out_format, *map(str, shards)],
+            stdout=subprocess.PIPE,
+        )
+    ]
+    if out_path.suffix != ".bcf":
+        procs.append(
+            subprocess.Popen(
+                ["bcftools", "view", "-Ov", "-"],
+                stdin=procs[0].stdout,
+                stdout=subprocess.PIPE,
+            )
+        )
+        procs[0].stdout.close()
+
+    counts = tee_counts(procs[-1].stdout, out_path)
+    if any(p.wait() != 0 for p in procs):
+        sys.exit(1)
 
-    for p in (p1, p2, p3, p4):
-        if p.wait() != 0:
-            sys.exit(1)
+    shutil.rmtree(shard_dir)
+    shutil.rmtree(index_dir)
+    return counts
+
+
+def run(base_path, config, context=None):
+    base_path = Path(base_path)
+    missing_to_ref = config.get("MISSING_TO_REF", "true").lower() == "true"
+    # 1 = one whole-genome chain; more = region-sharded merge in a pool
+    workers = int(config.get("MERGE_WORKERS", 1))
+    # window size in bp for the sharded merge (0 = one shard per contig)
+    region_size = int(config.get("MERGE_REGION_SIZE", 0))
+
+    in_path = base_path / "00_raw_vcf"
+    out_path = Path(data_path(base_path, "01_merged", config))
+
+    vcfs = sorted(in_path.glob("*.vcf"))
+    if not vcfs:
+        print(f"No VCFs found in {in_path}")
+        sys.exit(1)
+
+    flags = ["--missing-to-ref"] if missing_to_ref else []
+    print(f"Merge flags: {' '.join(flags) if flags else '(none)'}")
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    unlink_stale(out_path)
+
+    print("Merging VCF files...")
+
+    counts = {}
+    if workers > 1:
+        counts = merge_sharded(
+            vcfs, flags, out_path, workers, region_size, output_args(config)
+        )
+    elif not merge_chain(
+        vcfs, flags, out_path, out_format=output_args(config), counts=counts
+    ):
+        sys.exit(1)
+    write_index(out_path, config)
+
+    # counted on the way to disk instead of a second +counts pass
+    write_counts(out_path.parent, counts)
+    print_counts(counts)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.argv[0]} <base_path>")
+        sys.exit(1)
 
-    print("Counting variants...")
-    run(["bcftools", "+counts", str(out_path)])
+    run(sys.argv[1], os.environ)
 
 
 if __name__ == "__main__":
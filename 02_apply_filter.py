@@ -1,45 +1,116 @@
 import os
 import sys
+import json
 import subprocess
+from cyvcf2 import VCF
+from core.counts import print_counts, read_counts, tee_counts, write_counts
+from core.intermediate import data_path, output_args, unlink_stale, write_index
+from core.variant_filter import VariantFilter, filter_vcf, load_groups, parse_filter
 
-# 1. Check arguments (Equivalent to if [ -z "$BASE_PATH" ])
-if len(sys.argv) < 2:
-    print(f"Usage: {sys.argv[0]} <base_path>")
-    sys.exit(1)
 
-base_path = sys.argv[1]
+def native_filter(in_path, out_path, snp_filter, config):
+    """Filter with core.variant_filter and write per-predicate counts.
 
-# 2. Define paths
-in_path = os.path.join(base_path, "01_merged", "data.vcf")
-out_path = os.path.join(base_path, "02_filtered", "data.vcf")
+    Returns the totals of the written records.
+    """
+    predicates = parse_filter(snp_filter)
+    groups_path = config.get("FILTER_GROUPS", "")
+    chunk_size = int(config.get("FILTER_CHUNK_SIZE", 10000))
 
-# 3. Get Environment Variable (Equivalent to SNP_FILTER=${SNP_FILTER:-'none'})
-snp_filter = os.environ.get("SNP_FILTER", "none")
+    groups = None
+    if groups_path:
+        groups = load_groups(groups_path, VCF(in_path).samples)
+        sizes = ", ".join(f"{name} ({len(idx)})" for name, idx in groups.items())
+        print(f"Sample groups: {sizes}")
 
-# 4. Ensure output directory exists (Equivalent to mkdir -p)
-out_dir = os.path.dirname(out_path)
-if not os.path.exists(out_dir):
-    os.makedirs(out_dir)
+    mode = "wb" if out_path.endswith(".bcf") else "w"
+    report = filter_vcf(
+        in_path, out_path, VariantFilter(predicates, groups), mode, chunk_size
+    )
 
-# 5. Conditional Logic
-if snp_filter != "none":
-    print(f"Applying SNP filter: {snp_filter}")
+    print(f"Kept {report['kept']} of {report['total']} variants")
+    for text, count in report["rejected_by_predicate"].items():
+        print(f"  {text}: rejected {count}")
 
-    # Run bcftools view -i "$SNP_FILTER" $IN_PATH -o $OUT_PATH
-    subprocess.run(
-        ["bcftools", "view", "-i", snp_filter, in_path, "-o", out_path], check=True
-    )
+    report_path = os.path.join(os.path.dirname(out_path), "filter_report.json")
+    with open(report_path, "w") as f:
+        json.dump({"filter": snp_filter, **report}, f, indent=2)
+
+    return report["counts"]
+
+
+def run(base_path, config, context=None):
+    # 1. Define paths
+    in_path = data_path(base_path, "01_merged", config)
+    out_path = data_path(base_path, "02_filtered", config)
+
+    # 2. Get configuration (Equivalent to SNP_FILTER=${SNP_FILTER:-'none'})
+    snp_filter = config.get("SNP_FILTER", "none")
+    engine = config.get("FILTER_ENGINE", "bcftools").lower()
+
+    # 3. Ensure output directory exists (Equivalent to mkdir -p)
+    out_dir = os.path.dirname(out_path)
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    # links left by an unfiltered run would make us overwrite the input
+    unlink_stale(out_path)
+
+    # 4. Conditional Logic
+    if snp_filter != "none" and engine == "native":
+        print(f"Applying SNP filter natively: {snp_filter}")
+        counts = native_filter(in_path, out_path, snp_filter, config)
+        write_index(out_path, config)
+
+    elif snp_filter != "none" and engine == "bcftools":
+        print(f"Applying SNP filter: {snp_filter}")
+
+        # Run bcftools view -i "$SNP_FILTER" $IN_PATH, counting the
+        # records on their way to $OUT_PATH
+        view = subprocess.Popen(
+            ["bcftools", "view", "-i", snp_filter, *output_args(config), in_path],
+            stdout=subprocess.PIPE,
+        )
+        counts = tee_counts(view.stdout, out_path)
+        if view.wait() != 0:
+            raise subprocess.CalledProcessError(view.returncode, view.args)
+        write_index(out_path, config)
+
+    elif snp_filter != "none":
+        raise ValueError(f"Unknown FILTER_ENGINE: {engine}")
+
+    else:
+        print("No SNP filter applied, creating symlink to input instead of copying.")
+
+        # a BCF's CSI index is linked along with it
+        suffixes = [""]
+        if os.path.exists(f"{in_path}.csi"):
+            suffixes.append(".csi")
+
+        for suffix in suffixes:
+            rel_in_path = os.path.relpath(in_path + suffix, start=out_dir)
+
+            if os.path.exists(out_path + suffix) or os.path.islink(out_path + suffix):
+                os.remove(out_path + suffix)
+
+            os.symlink(rel_in_path, out_path + suffix)
+
+        # same records as the merged file
+        counts = read_counts(os.path.dirname(in_path))
+
+    if counts:
+        write_counts(out_dir, counts)
+        print_counts(counts)
 
-    print("Counting variants...")
-    # Run bcftools +counts $OUT_PATH
-    subprocess.run(["bcftools", "+counts", out_path], check=True)
 
-else:
-    print("No SNP filter applied, creating symlink to input instead of copying.")
+def main():
+    # Check arguments (Equivalent to if [ -z "$BASE_PATH" ])
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.argv[0]} <base_path>")
+        sys.exit(1)
 
-    rel_in_path = os.path.relpath(in_path, start=out_dir)
+    run(sys.argv[1], os.environ)
 
-    if os.path.exists(out_path) or os.path.islink(out_path):
-        os.remove(out_path)
 
-    os.symlink(rel_in_path, out_path)
+if __name__ == "__main__":
+    main()
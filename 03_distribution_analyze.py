@@ -1,83 +1,151 @@
 import os
 import sys
+import itertools
+import math
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from cyvcf2 import VCF
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
+from core.counts import read_counts
+from core.intermediate import data_path
+from core.streaming_stats import StreamingStats
 
+INFO_FIELDS = ["F_MISSING", "MAF", "AN", "AC_Het", "HWE"]
 
-if len(sys.argv) < 2:
-    print(f"Usage: {os.path.basename(sys.argv[0])} <base_path>")
-    sys.exit(1)
 
-BASE_PATH = sys.argv[1]
+class ColumnBuffer:
+    """Growable float32 columns, one value per variant and field."""
 
-# BASE_PATH = "data"
+    def __init__(self, fields, capacity=1 << 16):
+        self.size = 0
+        self.capacity = capacity
+        self.columns = {
+            field: np.empty(capacity, dtype=np.float32) for field in fields
+        }
 
-# File paths
-before_filter = f"{BASE_PATH}/01_merged"
-after_filter = f"{BASE_PATH}/02_filtered"
-output_dir = f"{BASE_PATH}/03_distribution_analyze"
+    def grow(self):
+        self.capacity *= 2
+        for field, values in self.columns.items():
+            grown = np.empty(self.capacity, dtype=np.float32)
+            grown[: self.size] = values[: self.size]
+            self.columns[field] = grown
 
-os.makedirs(output_dir, exist_ok=True)
+    def append(self, row):
+        if self.size == self.capacity:
+            self.grow()
+        for field, value in zip(self.columns, row):
+            self.columns[field][self.size] = value
+        self.size += 1
 
+    def arrays(self):
+        return {field: values[: self.size] for field, values in self.columns.items()}
 
-def process_vcf(vcf_path, output_prefix):
 
-    # Load VCF
-    vcf = VCF(vcf_path)
+def _scalar(value):
+    # one number, or NaN for missing and multi-valued entries
+    return np.nan if value is None or isinstance(value, tuple) else value
+
+
+def _info_row(variant):
+    info = variant.INFO
+    ac = info.get("AC")
+    if ac is None:
+        ac_sum, ac_n = np.nan, 1
+    elif isinstance(ac, tuple):
+        ac_sum, ac_n = sum(ac), len(ac)
+    else:
+        ac_sum, ac_n = ac, 1
+    return [*(_scalar(info.get(field)) for field in INFO_FIELDS), ac_sum, ac_n]
+
+
+def _frame(buffer):
+    """DataFrame of the buffered rows with the averaged AC and AC/AN."""
+    columns = buffer.arrays()
+    ac = columns.pop("AC_sum") / columns.pop("AC_n")
+    an = columns["AN"]
+    # AC/AN only where both are set and non-zero
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ac_to_an = np.where((ac != 0) & (an != 0), ac / an, np.nan)
+
+    return pd.DataFrame(
+        {
+            "F_MISSING": columns["F_MISSING"],
+            "MAF": columns["MAF"],
+            "AC": ac,
+            "AN": an,
+            "AC/AN": ac_to_an.astype(np.float32),
+            "AC_Het": columns["AC_Het"],
+            "HWE": columns["HWE"],
+        }
+    )
+
 
-    # Collect INFO fields
-    data = []
+def extract_info(vcf_path, capacity=None):
+    """INFO fields of every variant as float32 columns.
+
+    Multi-allelic AC is stored as its sum and allele count and averaged
+    in one vectorized step at the end.
+    """
+    buffer = ColumnBuffer([*INFO_FIELDS, "AC_sum", "AC_n"], capacity or 1 << 16)
+    for variant in VCF(vcf_path):
+        buffer.append(_info_row(variant))
+    return _frame(buffer)
+
+
+def iter_info_chunks(vcf, chunk_size):
+    """extract_info in frames of at most ``chunk_size`` variants.
+
+    The buffer is reused, so each frame is only valid until the next one.
+    """
+    buffer = ColumnBuffer([*INFO_FIELDS, "AC_sum", "AC_n"], chunk_size)
     for variant in vcf:
-        AC = variant.INFO.get("AC")
-
-        # use avg is AC is tuple (multi-allelic)
-        if isinstance(AC, (list, tuple)):
-            AC = sum(AC) / len(AC)
-
-        AN = variant.INFO.get("AN")
-        if AN and AC:
-            ac_to_an = AC / AN
-        else:
-            ac_to_an = None
-
-        data.append(
-            {
-                "F_MISSING": variant.INFO.get("F_MISSING"),
-                "MAF": variant.INFO.get("MAF"),
-                "AC": AC,
-                "AN": AN,
-                "AC/AN": ac_to_an,
-                "AC_Het": variant.INFO.get("AC_Het"),
-                "HWE": variant.INFO.get("HWE"),
-            }
-        )
+        buffer.append(_info_row(variant))
+        if buffer.size == chunk_size:
+            yield _frame(buffer)
+            buffer.size = 0
+    if buffer.size:
+        yield _frame(buffer)
 
-    # Convert to DataFrame
-    df = pd.DataFrame(data)
-    df = df.apply(pd.to_numeric, errors="coerce")
 
-    # Print summary statistics
-    print(df.describe())
+FIELDS = ["F_MISSING", "MAF", "AC", "AN", "AC_Het", "AC/AN", "HWE"]
+DESCRIPTIONS = [
+    "Fraction of missing genotypes per variant",
+    "Minor allele frequency",
+    "Allele count",
+    "Allele number",
+    "Heterozygous allele count",
+    "Allele count / Allele number ratio",
+    "Hardy-Weinberg Equilibrium p-value",
+]
 
-    # Plot distributions
+
+def field_ranges(n_samples):
+    """Histogram range per field; counts are bounded by 2 alleles per sample."""
+    n_alleles = 2 * max(n_samples, 1)
+    return {
+        "F_MISSING": (0, 1),
+        "MAF": (0, 0.5),
+        "AC": (0, n_alleles),
+        "AN": (0, n_alleles),
+        "AC_Het": (0, n_alleles),
+        "AC/AN": (0, 1),
+        "HWE": (0, 1),
+    }
+
+
+def plot_distributions(draw, output_path, note=None):
+    """One subplot per field; ``draw(field)`` plots its distribution."""
     sns.set(style="whitegrid")
-    fields = ["F_MISSING", "MAF", "AC", "AN", "AC_Het", "AC/AN", "HWE"]
-    descriptions = [
-        "Fraction of missing genotypes per variant",
-        "Minor allele frequency",
-        "Allele count",
-        "Allele number",
-        "Heterozygous allele count",
-        "Allele count / Allele number ratio",
-        "Hardy-Weinberg Equilibrium p-value",
-    ]
 
     plt.figure(figsize=(26, 4))
-    for i, (field, desc) in enumerate(zip(fields, descriptions), 1):
+    if note:
+        plt.suptitle(note, fontsize=10)
+    for i, (field, desc) in enumerate(zip(FIELDS, DESCRIPTIONS), 1):
         plt.subplot(1, 7, i)
-        sns.histplot(df[field].dropna(), kde=True, bins=20)
+        draw(field)
         plt.title(f"{field} Distribution")
         plt.xlabel(field)
         plt.ylabel("Frequency")
@@ -91,8 +159,200 @@ def process_vcf(vcf_path, output_prefix):
             fontsize=9,
         )
     plt.tight_layout()
-    plt.savefig(f"{output_dir}/{output_prefix}_distribution.png")
+    plt.savefig(output_path)
+
+
+def process_vcf(vcf_path, output_prefix, output_dir):
+    # Collect INFO fields, sized from the stage's counts when known
+    counts = read_counts(os.path.dirname(vcf_path))
+    df = extract_info(vcf_path, counts["variants"] if counts else None)
+
+    # Print summary statistics (labelled, the two files run side by side)
+    print(f"{output_prefix}:\n{df.describe()}")
+
+    # Plot distributions
+    plot_distributions(
+        lambda field: sns.histplot(df[field].dropna(), kde=True, bins=20),
+        f"{output_dir}/{output_prefix}_distribution.png",
+    )
+
+
+def process_vcf_streaming(vcf_path, output_prefix, output_dir, chunk_size):
+    """process_vcf in constant memory: accumulators instead of a DataFrame."""
+    vcf = VCF(vcf_path)
+    stats = {
+        field: StreamingStats(lo, hi)
+        for field, (lo, hi) in field_ranges(len(vcf.samples)).items()
+    }
+    for chunk in iter_info_chunks(vcf, chunk_size):
+        for field, field_stats in stats.items():
+            field_stats.update(chunk[field].to_numpy())
+
+    summary = pd.DataFrame({field: stats[field].describe() for field in FIELDS})
+    print(f"{output_prefix}:\n{summary}")
+
+    def draw(field):
+        counts, edges = stats[field].histogram(bins=20)
+        plt.stairs(counts, edges, fill=True, alpha=0.6)
+        # density scaled to counts per plotted bin, as histplot's kde line
+        x, density = stats[field].kde()
+        plt.plot(x, density * stats[field].n * (edges[1] - edges[0]))
+
+    plot_distributions(draw, f"{output_dir}/{output_prefix}_distribution.png")
+
+
+def _reservoir(variants, size, rng):
+    """Uniform sample of ``size`` INFO rows (Algorithm L) and the number seen.
+
+    Skips ahead by geometric jumps, so INFO is only decoded for variants
+    that enter the reservoir.
+    """
+    rows = []
+    seen = 0
+    for variant in variants:
+        seen += 1
+        rows.append(_info_row(variant))
+        if len(rows) == size:
+            break
+    if len(rows) < size:
+        return rows, seen
+
+    w = math.exp(math.log(rng.random()) / size)
+    next_index = seen + math.floor(math.log(rng.random()) / math.log(1 - w)) + 1
+    for variant in variants:
+        seen += 1
+        if seen == next_index:
+            rows[rng.integers(size)] = _info_row(variant)
+            w *= math.exp(math.log(rng.random()) / size)
+            next_index += math.floor(math.log(rng.random()) / math.log(1 - w)) + 1
+    return rows, seen
+
+
+def sample_info(vcf_path, method, size, every, regions, seed):
+    """INFO frame of a sample of the variants, and how many were seen.
+
+    ``method`` is "reservoir" (uniform, ``size`` variants), "nth" (every
+    ``every``-th variant) or "none" (all). ``regions`` limits the scan
+    and needs a .csi/.tbi index.
+    """
+    vcf = VCF(vcf_path)
+    if regions:
+        if not any(os.path.exists(vcf_path + ext) for ext in (".csi", ".tbi")):
+            raise ValueError(f"Region sampling needs an index for {vcf_path}")
+        variants = itertools.chain.from_iterable(vcf(region) for region in regions)
+    else:
+        variants = iter(vcf)
+
+    if method == "reservoir":
+        rows, seen = _reservoir(variants, size, np.random.default_rng(seed))
+    elif method in ("nth", "none"):
+        step = every if method == "nth" else 1
+        rows, seen = [], 0
+        for seen, variant in enumerate(variants, 1):
+            if (seen - 1) % step == 0:
+                rows.append(_info_row(variant))
+    else:
+        raise ValueError(f"Unknown DISTRIBUTION_SAMPLE: {method}")
+
+    buffer = ColumnBuffer([*INFO_FIELDS, "AC_sum", "AC_n"], max(len(rows), 1))
+    for row in rows:
+        buffer.append(row)
+    return _frame(buffer), seen
+
+
+def sampling_note(df, seen, total, regions):
+    """Sampling fraction and 95% confidence of a sampled frame.
+
+    The CDF bound is the Dvoretzky-Kiefer-Wolfowitz inequality; mean
+    intervals are normal with the finite population correction. Both
+    assume the sample is random, which every-Nth only approximates.
+    """
+    n = len(df)
+    scope = f"in {', '.join(regions)}" if regions else "in the file"
+    lines = [f"Sampled {n} of {seen} variants {scope} ({n / max(seen, 1):.2%})"]
+    if regions and total:
+        lines[0] += f"; the file has {total}"
+    if n:
+        epsilon = math.sqrt(math.log(2 / 0.05) / (2 * n))
+        lines.append(f"95% confidence: every plotted CDF within +/-{epsilon:.3f}")
+        correction = math.sqrt(max(0.0, 1 - n / seen))
+        for field in FIELDS:
+            values = df[field].dropna()
+            if len(values) > 1:
+                half = 1.96 * values.std() / math.sqrt(len(values)) * correction
+                lines.append(f"  {field} mean {values.mean():.4g} +/- {half:.2g}")
+    return "\n".join(lines)
+
+
+def process_vcf_sampled(vcf_path, output_prefix, output_dir, sampling):
+    """process_vcf on a sample of the variants, for quick previews."""
+    df, seen = sample_info(vcf_path, **sampling)
+    counts = read_counts(os.path.dirname(vcf_path))
+    note = sampling_note(
+        df, seen, counts["variants"] if counts else None, sampling["regions"]
+    )
+
+    print(f"{output_prefix}:\n{note}\n{df.describe()}")
+
+    plot_distributions(
+        lambda field: sns.histplot(df[field].dropna(), kde=True, bins=20),
+        f"{output_dir}/{output_prefix}_distribution.png",
+        note="; ".join(note.splitlines()[:2]),
+    )
+
+
+def run(base_path, config, context=None):
+    # File paths
+    output_dir = f"{base_path}/03_distribution_analyze"
+    os.makedirs(output_dir, exist_ok=True)
+
+    # full: every value in memory, seaborn plots
+    # streaming: fixed-size histograms and moments, constant memory
+    mode = config.get("DISTRIBUTION_MODE", "full").lower()
+    chunk_size = int(config.get("DISTRIBUTION_CHUNK_SIZE", 65536))
+    # preview: reservoir / nth sampling, optionally limited to regions
+    sampling = {
+        "method": config.get("DISTRIBUTION_SAMPLE", "none").lower(),
+        "size": int(config.get("DISTRIBUTION_SAMPLE_SIZE", 100000)),
+        "every": int(config.get("DISTRIBUTION_SAMPLE_EVERY", 100)),
+        "regions": [
+            region for region in config.get("DISTRIBUTION_REGIONS", "").split(",")
+            if region
+        ],
+        "seed": int(config.get("DISTRIBUTION_SEED", 0)),
+    }
+
+    if sampling["method"] != "none" or sampling["regions"]:
+        work = partial(process_vcf_sampled, sampling=sampling)
+    elif mode == "full":
+        work = process_vcf
+    elif mode == "streaming":
+        work = partial(process_vcf_streaming, chunk_size=chunk_size)
+    else:
+        raise ValueError(f"Unknown DISTRIBUTION_MODE: {mode}")
+
+    jobs = [
+        (data_path(base_path, "01_merged", config), "before"),
+        (data_path(base_path, "02_filtered", config), "after"),
+    ]
+
+    # before and after are independent scans, one process each
+    with ProcessPoolExecutor(max_workers=len(jobs)) as pool:
+        futures = [
+            pool.submit(work, vcf_path, prefix, output_dir)
+            for vcf_path, prefix in jobs
+        ]
+        for future in futures:
+            future.result()
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(f"Usage: {os.path.basename(sys.argv[0])} <base_path>")
+        sys.exit(1)
+
+    run(sys.argv[1], os.environ)
 
 
-process_vcf(f"{before_filter}/data.vcf", "before")
-process_vcf(f"{after_filter}/data.vcf", "after")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import subprocess
+from core.intermediate import (
+    bfile_prefix,
+    data_path,
+    plink_input_args,
+    plink_resource_args,
+    record_bfile_source,
+)
+
+
+def run(base_path, config, context=None):
+    in_path = data_path(base_path, "02_filtered", config)
+    out_path = bfile_prefix(base_path)
+
+    # Import the VCF/BCF once; kinship, PCA and MDS read the binary set
+    cmd = [
+        "plink",
+        *plink_input_args(in_path),
+        *plink_resource_args(config),
+        "--make-bed",
+        "--out",
+        out_path,
+    ]
+
+    log_file = f"{out_path}.log"
+    with open(log_file, "w") as f:
+        subprocess.run(cmd, check=True, stdout=f, stderr=subprocess.STDOUT)
+
+    # lets the later steps tell whether the binary set is still current
+    record_bfile_source(base_path, config)
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(f"Usage: {sys.argv[0]} <base_path>")
+        sys.exit(1)
+
+    run(sys.argv[1], os.environ)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,34 +3,64 @@
 import sys
 import os
 import subprocess
+from core.ibs import write_ibs
+from core.intermediate import data_path, plink_data_args, plink_resource_args
+from core.kinship import KINSHIP_SOURCES, convert_to_store
 
-def main():
-    if len(sys.argv) < 2:
-        print(f"Usage: {sys.argv[0]} <base_path>")
-        sys.exit(1)
-
-    base_path = sys.argv[1]
 
-    in_path = os.path.join(base_path, "02_filtered", "data.vcf")
+def run(base_path, config, context=None):
+    in_path = data_path(base_path, "02_filtered", config)
     out_path = os.path.join(base_path, "10_kinship", "out")
 
     # ensure output directory exists
     os.makedirs(os.path.dirname(out_path), exist_ok=True)
 
-    log_path = f"{out_path}.log"
-
-    with open(log_path, "w") as log_file:
-        subprocess.run(
-            [
-                "plink",
-                "--vcf", in_path,
-                "--distance", "ibs", "flat-missing", "square",
-                "--out", out_path
-            ],
-            stdout=log_file,
-            stderr=subprocess.STDOUT,
-            check=True
-        )
+    engine = config.get("KINSHIP_ENGINE", "plink").lower()
+
+    if engine == "native":
+        block_size = int(config.get("KINSHIP_BLOCK_SIZE", 1024))
+        threads = int(config.get("KINSHIP_THREADS", 0)) or None
+        print(f"Computing IBS natively (block size {block_size})")
+        write_ibs(in_path, out_path, block_size=block_size, threads=threads)
+
+    elif engine == "plink":
+        log_path = f"{out_path}.log"
+
+        with open(log_path, "w") as log_file:
+            subprocess.run(
+                [
+                    "plink",
+                    *plink_data_args(base_path, config),
+                    *plink_resource_args(config),
+                    "--distance", "ibs", "flat-missing", "square",
+                    "--out", out_path
+                ],
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+                check=True
+            )
+
+    else:
+        raise ValueError(f"Unknown KINSHIP_ENGINE: {engine}")
+
+    # matrices left by earlier runs must not be converted over this one
+    keep = "plink" if engine == "plink" else None
+    for name, suffix in KINSHIP_SOURCES.items():
+        if name != keep and os.path.exists(f"{out_path}{suffix}"):
+            os.remove(f"{out_path}{suffix}")
+
+    # float32 memory-mappable store shared by the plot and query scripts;
+    # the native engine writes it directly
+    if engine == "plink":
+        convert_to_store(base_path, "plink")
+
+def main():
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.argv[0]} <base_path>")
+        sys.exit(1)
+
+    run(sys.argv[1], os.environ)
+
 
 if __name__ == "__main__":
     main()
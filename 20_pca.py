@@ -4,11 +4,22 @@ import os
 import sys
 import subprocess
 from pathlib import Path
-from pathlib import Path
+from core.intermediate import (
+    filtered_genotypes,
+    plink_data_args,
+    plink_resource_args,
+)
+from core.pca import (
+    MODEL_SUFFIX,
+    PROJECTED_SUFFIX,
+    GenotypeSource,
+    randomized_pca,
+    write_pca,
+)
 from core.var_wts_topk import write_topk_json
 
 
-def run(cmd, log_file=None):
+def run_command(cmd, log_file=None):
     if log_file:
         with open(log_file, "w") as f:
             subprocess.run(cmd, check=True, stdout=f, stderr=subprocess.STDOUT)
@@ -16,40 +27,74 @@ def run(cmd, log_file=None):
         subprocess.run(cmd, check=True)
 
 
-def main():
-    if len(sys.argv) != 2:
-        print(f"Usage: {sys.argv[0]} <base_path>")
-        sys.exit(1)
-
-    base_path = Path(sys.argv[1])
-    pca_count = int(os.environ.get("PCA_COUNT", 10))
+def run(base_path, config, context=None):
+    base_path = Path(base_path)
+    pca_count = int(config.get("PCA_COUNT", 10))
 
-    in_path = base_path / "02_filtered" / "data.vcf"
     out_path = base_path / "20_pca" / "out"
 
     # ensure output directory exists
     out_path.parent.mkdir(parents=True, exist_ok=True)
 
-    cmd = [
-        "plink",
-        "--vcf",
-        str(in_path),
-        "--cluster",
-        "--pca",
-        str(pca_count),
-        "var-wts",
-        "header",
-        "--out",
-        str(out_path),
-    ]
-
-    log_file = f"{out_path}.log"
-    run(cmd, log_file=log_file)
+    engine = config.get("PCA_ENGINE", "plink").lower()
+
+    # a new PCA invalidates the projection model and the projected rows
+    for suffix in (MODEL_SUFFIX, PROJECTED_SUFFIX):
+        if os.path.exists(f"{out_path}{suffix}"):
+            os.remove(f"{out_path}{suffix}")
+
+    if engine == "native":
+        source = GenotypeSource(
+            filtered_genotypes(base_path, config),
+            block_size=int(config.get("PCA_BLOCK_SIZE", 1024)),
+        )
+        print(f"Computing {pca_count} PCs natively for {len(source.ids)} samples")
+        eigenvectors, eigenvalues, singular_values = randomized_pca(
+            source,
+            pca_count,
+            oversample=int(config.get("PCA_OVERSAMPLE", 10)),
+            power_iterations=int(config.get("PCA_POWER_ITERATIONS", 2)),
+            seed=int(config.get("PCA_SEED", 0)),
+        )
+        write_pca(source, out_path, eigenvectors, eigenvalues, singular_values)
+
+    elif engine == "plink":
+        cmd = [
+            "plink",
+            *plink_data_args(base_path, config),
+            *plink_resource_args(config),
+            "--cluster",
+            "--pca",
+            str(pca_count),
+            "var-wts",
+            "header",
+            "--out",
+            str(out_path),
+        ]
+
+        log_file = f"{out_path}.log"
+        run_command(cmd, log_file=log_file)
+
+    else:
+        raise ValueError(f"Unknown PCA_ENGINE: {engine}")
 
     var_wts = f"{out_path}.eigenvec.var"
     topk_out = f"{out_path}.eigenvec.var.topk.json"
 
-    write_topk_json(var_wts, topk_out, k=100)
+    write_topk_json(
+        var_wts,
+        topk_out,
+        k=100,
+        chunk_size=int(config.get("PCA_TOPK_CHUNK_SIZE", 100_000)),
+    )
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(f"Usage: {sys.argv[0]} <base_path>")
+        sys.exit(1)
+
+    run(sys.argv[1], os.environ)
 
 
 if __name__ == "__main__":
@@ -4,9 +4,12 @@ import os
 import sys
 import subprocess
 from pathlib import Path
+from core.intermediate import plink_data_args, plink_resource_args
+from core.kinship import KinshipStore
+from core.mds import classical_mds, write_mds
 
 
-def run(cmd, log_file=None):
+def run_command(cmd, log_file=None):
     if log_file:
         with open(log_file, "w") as f:
             subprocess.run(cmd, check=True, stdout=f, stderr=subprocess.STDOUT)
@@ -14,33 +17,54 @@ def run(cmd, log_file=None):
         subprocess.run(cmd, check=True)
 
 
-def main():
-    if len(sys.argv) != 2:
-        print(f"Usage: {sys.argv[0]} <base_path>")
-        sys.exit(1)
-
-    base_path = Path(sys.argv[1])
-    pca_count = int(os.environ.get("PCA_COUNT", 10))
+def run(base_path, config, context=None):
+    base_path = Path(base_path)
+    pca_count = int(config.get("PCA_COUNT", 10))
 
-    in_path = base_path / "02_filtered" / "data.vcf"
     out_path = base_path / "21_mds" / "out"
 
     # ensure output directory exists
     out_path.parent.mkdir(parents=True, exist_ok=True)
 
-    cmd = [
-        "plink",
-        "--vcf",
-        str(in_path),
-        "--cluster",
-        "--mds-plot",
-        str(pca_count),
-        "--out",
-        str(out_path),
-    ]
-
-    log_file = f"{out_path}.log"
-    run(cmd, log_file=log_file)
+    engine = config.get("MDS_ENGINE", "plink").lower()
+
+    if engine == "native":
+        # classical MDS of the IBS matrix 10_kinship already wrote,
+        # instead of plink recomputing it with --cluster
+        store = KinshipStore.open(base_path)
+        print(f"Computing {pca_count} MDS dimensions from {store.path}")
+        coordinates, _, imputed = classical_mds(
+            store.matrix, pca_count, seed=int(config.get("MDS_SEED", 0))
+        )
+        if imputed:
+            print(f"[WARN] Imputed {imputed} missing IBS distances")
+        write_mds(f"{out_path}.mds", zip(store.fids, store.iids), coordinates)
+
+    elif engine == "plink":
+        cmd = [
+            "plink",
+            *plink_data_args(base_path, config),
+            *plink_resource_args(config),
+            "--cluster",
+            "--mds-plot",
+            str(pca_count),
+            "--out",
+            str(out_path),
+        ]
+
+        log_file = f"{out_path}.log"
+        run_command(cmd, log_file=log_file)
+
+    else:
+        raise ValueError(f"Unknown MDS_ENGINE: {engine}")
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(f"Usage: {sys.argv[0]} <base_path>")
+        sys.exit(1)
+
+    run(sys.argv[1], os.environ)
 
 
 if __name__ == "__main__":
@@ -1,133 +1,293 @@
 from cyvcf2 import VCF
 import os
-import sys
+import argparse
+import subprocess
 import pandas as pd
-from core.cluster_profiler import ClusterProfiler
+from concurrent.futures import ProcessPoolExecutor
+from core.cluster_profiler import ClusterProfiler, BatchClusterProfiler
+from core.intermediate import data_path
 import json
 
-if len(sys.argv) < 2:
-    print(f"Usage: {os.path.basename(sys.argv[0])} <base_path>")
-    sys.exit(1)
-
-BASE_PATH = sys.argv[1]
-
-# File paths
-vcf_path = f"{BASE_PATH}/01_merged/data.vcf"
-cluster_path = f"{BASE_PATH}/30_cluster/pca_hdbscan_clusters_plink.tsv"
-cluster_profile_dir = f"{BASE_PATH}/31_cluster_profile"
-
-os.makedirs(cluster_profile_dir, exist_ok=True)
-
-# Load cluster assignment table
-clusters = pd.read_csv(cluster_path, sep="\t")
-
-# Separate out outliers
-outlier_samples = clusters.loc[clusters["Cluster"] == "Outlier", "IID"].tolist()
-clusters = clusters.loc[clusters["Cluster"] != "Outlier"]
-
-unq_cluster_names = clusters["Cluster"].unique()
-print(f"Found clusters: {unq_cluster_names}")
-print(f"Found outlier samples: {outlier_samples}")
-
-# Load VCF
-vcf = VCF(vcf_path)
-sample_names = list(vcf.samples)
-sample_name_to_index = {s: i for i, s in enumerate(sample_names)}
-index_to_sample_name = {v: k for k, v in sample_name_to_index.items()}
-
-# Create ClusterProfiler objects for each cluster
-profilers = {}
-for cluster_name in unq_cluster_names:
-    cluster_samples = clusters.loc[clusters["Cluster"] == cluster_name, "IID"].tolist()
-    cluster_indices = [
-        sample_name_to_index[s] for s in cluster_samples if s in sample_name_to_index
-    ]
-    if not cluster_indices:
-        print(
-            f"⚠️ Warning: Cluster {cluster_name} has no matching VCF samples, skipping."
+def load_clusters(cluster_path, context=None):
+    # Load cluster assignment table (shared by 30_cluster when in-process)
+    if context and "clusters" in context:
+        clusters = context["clusters"]
+    else:
+        clusters = pd.read_csv(cluster_path, sep="\t")
+
+    # Separate out outliers
+    outlier_samples = clusters.loc[clusters["Cluster"] == "Outlier", "IID"].tolist()
+    clusters = clusters.loc[clusters["Cluster"] != "Outlier"]
+    return clusters, outlier_samples
+
+
+def create_profilers(clusters, outlier_samples, sample_names, verbose=True):
+    sample_name_to_index = {s: i for i, s in enumerate(sample_names)}
+
+    # Create ClusterProfiler objects for each cluster
+    profilers = {}
+    for cluster_name in clusters["Cluster"].unique():
+        cluster_samples = clusters.loc[
+            clusters["Cluster"] == cluster_name, "IID"
+        ].tolist()
+        cluster_indices = [
+            sample_name_to_index[s] for s in cluster_samples if s in sample_name_to_index
+        ]
+        if not cluster_indices:
+            if verbose:
+                print(
+                    f"⚠️ Warning: Cluster {cluster_name} has no matching VCF samples, skipping."
+                )
+            continue
+        profilers[cluster_name] = ClusterProfiler(
+            name=str(cluster_name), idx=cluster_indices, k=20
         )
-        continue
-    profilers[cluster_name] = ClusterProfiler(
-        name=str(cluster_name), idx=cluster_indices, k=20
+
+    # Create dedicated profilers for each outlier
+    outlier_profilers = {}
+    for outlier in outlier_samples:
+        if outlier not in sample_name_to_index:
+            if verbose:
+                print(f"⚠️ Warning: Outlier {outlier} not found in VCF, skipping.")
+            continue
+        outlier_idx = [sample_name_to_index[outlier]]
+        outlier_profilers[outlier] = ClusterProfiler(
+            name=outlier, idx=outlier_idx, k=100
+        )
+
+    return profilers, outlier_profilers
+
+
+def profile_variants(
+    variants, all_profilers, n_samples, batch_size, log_every=1000
+):
+    """Feed every variant to all profilers."""
+    if batch_size > 0:
+        batch = BatchClusterProfiler(
+            all_profilers, n_samples=n_samples, block_size=batch_size
+        )
+        for i, variant in enumerate(variants):
+            if log_every and i % log_every == 0:
+                print(f"Processing variant {i}...")
+            batch.add(variant)
+        batch.flush()
+    else:
+        for i, variant in enumerate(variants):
+            if log_every and i % log_every == 0:
+                print(f"Processing variant {i}...")
+            for profiler in all_profilers:
+                profiler.process_variant(variant)
+
+
+# ---------------------------
+# Region sharding (--workers)
+# ---------------------------
+def indexed_vcf(vcf_path, cluster_profile_dir):
+    """Return a region-queryable copy of the VCF, creating one if needed.
+
+    The copy is kept and reused for as long as it is newer than the VCF.
+    """
+    for suffix in (".csi", ".tbi"):
+        if os.path.exists(vcf_path + suffix):
+            return vcf_path
+
+    bgz_path = os.path.join(cluster_profile_dir, "data.vcf.gz")
+    index_path = bgz_path + ".csi"
+    if os.path.exists(index_path):
+        if os.path.getmtime(index_path) >= os.path.getmtime(vcf_path):
+            return bgz_path
+
+    print(f"No index for {vcf_path}, writing indexed copy to {bgz_path}")
+    subprocess.run(["bcftools", "view", "-Oz", "-o", bgz_path, vcf_path], check=True)
+    subprocess.run(["bcftools", "index", "-f", bgz_path], check=True)
+    return bgz_path
+
+
+def indexed_contigs(vcf_path):
+    """(contig, length) of the contigs holding records, from the index.
+
+    ``bcftools index -s`` reads only the index. Its order is the order of
+    the records: tabix-style indexes number contigs as they meet them, and
+    bcftools writes BCF records in header order. The shard number is the
+    file-order tie breaker when merging heaps, so it has to follow them.
+    """
+    stats = subprocess.run(
+        ["bcftools", "index", "-s", vcf_path],
+        check=True,
+        stdout=subprocess.PIPE,
+        text=True,
+    ).stdout
+    contigs = []
+    for line in stats.splitlines():
+        name, length, _ = line.split("\t")
+        contigs.append((name, int(length) if length.isdigit() else None))
+    return contigs
+
+
+def make_shards(contigs, shard_size):
+    """Split (contig, length) pairs into (contig, start, end) shards in order."""
+    shards = []
+    for contig, length in contigs:
+        if not shard_size or not length:
+            shards.append((contig, None, None))
+            continue
+        for start in range(1, length + 1, shard_size):
+            shards.append((contig, start, min(start + shard_size - 1, length)))
+    return shards
+
+
+def profile_shard(vcf_path, clusters, outlier_samples, batch_size, shard):
+    """Profile one region and return each profiler's heap in portable form."""
+    contig, start, end = shard
+
+    vcf = VCF(vcf_path)
+    sample_names = list(vcf.samples)
+    profilers, outlier_profilers = create_profilers(
+        clusters, outlier_samples, sample_names, verbose=False
     )
+    all_profilers = list(profilers.values()) + list(outlier_profilers.values())
 
-# Create dedicated profilers for each outlier
-outlier_profilers = {}
-for outlier in outlier_samples:
-    if outlier not in sample_name_to_index:
-        print(f"⚠️ Warning: Outlier {outlier} not found in VCF, skipping.")
-        continue
-    outlier_idx = [sample_name_to_index[outlier]]
-    outlier_profilers[outlier] = ClusterProfiler(name=outlier, idx=outlier_idx, k=100)
-
-print(
-    f"Created {len(profilers)} cluster profilers and {len(outlier_profilers)} outlier profilers."
-)
-
-# Process each variant and feed to all profilers
-for i, variant in enumerate(vcf):
-    if i % 1000 == 0:
-        print(f"Processing variant {i}...")
-    for profiler in list(profilers.values()) + list(outlier_profilers.values()):
-        profiler.process_variant(variant)
-
-print("Finished processing all variants.\n")
-
-# Compile results
-results = {"clusters": {}, "outliers": {}}
-
-for name, profiler in profilers.items():
-    top_variants = profiler.get_topk()
-    cluster_data = {
-        "samples": [index_to_sample_name[i] for i in profiler.idx],
-        "top_variants": [],
-    }
-    for entry in top_variants:
-        var = entry["variant"]
-        chrom = var.CHROM
-        pos = var.POS
-        ref = var.REF
-        alt = ",".join(var.ALT) if isinstance(var.ALT, (list, tuple)) else var.ALT
-        cluster_data["top_variants"].append(
-            {
-                "chr": chrom,
-                "pos": pos,
-                "ref": ref,
-                "alt": alt,
-                "in_cluster_avg": entry["in_cluster_avg"],
-                "out_cluster_avg": entry["out_cluster_avg"],
-                "score": entry["score"],
-            }
+    if start is None:
+        variants = vcf(contig)
+    else:
+        # region queries return overlapping records; keep those starting here
+        variants = (
+            v for v in vcf(f"{contig}:{start}-{end}") if start <= v.POS <= end
         )
-    results["clusters"][name] = cluster_data
-
-for name, profiler in outlier_profilers.items():
-    top_variants = profiler.get_topk()
-    outlier_data = {
-        "samples": [index_to_sample_name[i] for i in profiler.idx],
-        "top_variants": [],
-    }
-    for entry in top_variants:
-        var = entry["variant"]
-        chrom = var.CHROM
-        pos = var.POS
-        ref = var.REF
-        alt = ",".join(var.ALT) if isinstance(var.ALT, (list, tuple)) else var.ALT
-        outlier_data["top_variants"].append(
-            {
-                "chr": chrom,
-                "pos": pos,
-                "ref": ref,
-                "alt": alt,
-                "in_cluster_avg": entry["in_cluster_avg"],
-                "out_cluster_avg": entry["out_cluster_avg"],
-                "score": entry["score"],
-            }
+
+    profile_variants(
+        variants, all_profilers, len(sample_names), batch_size, log_every=0
+    )
+
+    return [profiler.topk for profiler in all_profilers]
+
+
+def profile_sharded(
+    vcf_path,
+    clusters,
+    outlier_samples,
+    cluster_profile_dir,
+    all_profilers,
+    workers,
+    batch_size,
+    shard_size,
+):
+    """Run shards in a process pool and merge their heaps into all_profilers.
+
+    Every profiler ends up with the same top-k variants, in the same
+    order, as a sequential run.
+    """
+    vcf_path = indexed_vcf(vcf_path, cluster_profile_dir)
+    shards = make_shards(indexed_contigs(vcf_path), shard_size)
+    print(f"Profiling {len(shards)} shards with {workers} workers...")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(
+            profile_shard,
+            [vcf_path] * len(shards),
+            [clusters] * len(shards),
+            [outlier_samples] * len(shards),
+            [batch_size] * len(shards),
+            shards,
+        )
+        for shard_no, (shard, heaps) in enumerate(zip(shards, results)):
+            print(f"Finished shard {shard_no + 1}/{len(shards)}: {shard[0]}")
+            for profiler, heap in zip(all_profilers, heaps):
+                # (shard, counter) keeps ties in file order across shards
+                profiler.merge(
+                    (score, (shard_no, counter), entry)
+                    for score, counter, entry in heap
+                )
+
+
+def run(base_path, config, context=None, workers=None):
+    BASE_PATH = base_path
+
+    # Variants decoded into the shared dosage buffer per block (0 = legacy
+    # per-profiler loop)
+    batch_size = int(config.get("CLUSTER_PROFILE_BATCH_SIZE", 2000))
+    # Genomic window per shard in --workers mode (0 = one shard per contig)
+    shard_size = int(config.get("CLUSTER_PROFILE_SHARD_SIZE", 0))
+    if workers is None:
+        workers = int(config.get("CLUSTER_PROFILE_WORKERS", 1))
+
+    # File paths
+    vcf_path = data_path(BASE_PATH, "01_merged", config)
+    cluster_path = f"{BASE_PATH}/30_cluster/pca_clusters_plink.tsv"
+    cluster_profile_dir = f"{BASE_PATH}/31_cluster_profile"
+
+    os.makedirs(cluster_profile_dir, exist_ok=True)
+
+    clusters, outlier_samples = load_clusters(cluster_path, context)
+
+    unq_cluster_names = clusters["Cluster"].unique()
+    print(f"Found clusters: {unq_cluster_names}")
+    print(f"Found outlier samples: {outlier_samples}")
+
+    # Load VCF
+    vcf = VCF(vcf_path)
+    sample_names = list(vcf.samples)
+    index_to_sample_name = dict(enumerate(sample_names))
+
+    profilers, outlier_profilers = create_profilers(
+        clusters, outlier_samples, sample_names
+    )
+
+    print(
+        f"Created {len(profilers)} cluster profilers and {len(outlier_profilers)} outlier profilers."
+    )
+
+    # Process each variant and feed to all profilers
+    all_profilers = list(profilers.values()) + list(outlier_profilers.values())
+
+    if workers > 1:
+        profile_sharded(
+            vcf_path,
+            clusters,
+            outlier_samples,
+            cluster_profile_dir,
+            all_profilers,
+            workers,
+            batch_size,
+            shard_size,
         )
-    results["outliers"][name] = outlier_data
+    else:
+        profile_variants(vcf, all_profilers, len(sample_names), batch_size)
+
+    print("Finished processing all variants.\n")
+
+    # Compile results
+    results = {"clusters": {}, "outliers": {}}
+
+    for group, group_profilers in (
+        ("clusters", profilers),
+        ("outliers", outlier_profilers),
+    ):
+        for name, profiler in group_profilers.items():
+            results[group][name] = {
+                "samples": [index_to_sample_name[i] for i in profiler.idx],
+                "top_variants": [entry.to_dict() for entry in profiler.get_topk()],
+            }
+
+    # Save to a JSON file
+    with open(f"{cluster_profile_dir}/result.json", "w") as f:
+        json.dump(results, f, indent=4)
+
+    print(f"Results saved to {cluster_profile_dir}/result.json")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base_path")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="profile region shards in N processes",
+    )
+    args = parser.parse_args()
+
+    run(args.base_path, os.environ, workers=args.workers)
 
-# Save to a JSON file
-with open(f"{cluster_profile_dir}/result.json", "w") as f:
-    json.dump(results, f, indent=4)
 
-print(f"Results saved to {cluster_profile_dir}/result.json")
+if __name__ == "__main__":
+    main()
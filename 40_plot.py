@@ -6,6 +6,7 @@ import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 import os
 import sys
+from core.kinship import KinshipStore
 
 # ---------------------------
 # Argument Parsing
@@ -21,8 +22,6 @@ BASE_PATH = sys.argv[1]
 # ---------------------------
 pca_input = f"{BASE_PATH}/20_pca/out.eigenvec"
 mds_input = f"{BASE_PATH}/21_mds/out.mds"
-kinship_input = f"{BASE_PATH}/10_kinship/out.mibs"
-kinship_id_input = f"{BASE_PATH}/10_kinship/out.mibs.id"
 output_dir = f"{BASE_PATH}/40_plot"
 
 os.makedirs(output_dir, exist_ok=True)
@@ -109,17 +108,11 @@ else:
 # ---------------------------
 # Load Kinship matrix
 # ---------------------------
-ids = pd.read_csv(kinship_id_input, sep="\\s+", header=None)
-ids.columns = ["FID", "IID"]
-samples = ids["IID"].tolist()
+store = KinshipStore.open(BASE_PATH)
+kinship_matrix = np.asarray(store.matrix)
+samples = store.iids
 n = len(samples)
 
-triangular_matrix = np.loadtxt(kinship_input)
-kinship_matrix = np.zeros((n, n))
-for i in range(n):
-    kinship_matrix[i, : i + 1] = triangular_matrix[i, : i + 1]
-    kinship_matrix[: i + 1, i] = triangular_matrix[i, : i + 1]
-
 # ---------------------------
 # Plot triangular kinship heatmap
 # ---------------------------
@@ -17,13 +17,7 @@ dirs_to_remove = [
 ]
 
 
-def main():
-    if len(sys.argv) != 2:
-        print(f"Usage: {sys.argv[0]} <base_path>")
-        sys.exit(1)
-
-    base_path = sys.argv[1]
-
+def run(base_path, config, context=None):
     # Remove directories if they exist
     for dir_name in dirs_to_remove:
         full_path = os.path.join(base_path, dir_name)
@@ -34,5 +28,13 @@ def main():
             print(f"Skipping (not found): {full_path}")
 
 
+def main():
+    if len(sys.argv) != 2:
+        print(f"Usage: {sys.argv[0]} <base_path>")
+        sys.exit(1)
+
+    run(sys.argv[1], os.environ)
+
+
 if __name__ == "__main__":
     main()
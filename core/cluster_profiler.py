@@ -1,6 +1,48 @@
 import heapq
+import sys
 from typing import List
 
+import numpy as np
+
+
+class TopVariant:
+    """Compact heap entry holding only what result.json needs.
+
+    Heap entries used to keep the live cyvcf2 Variant, which pins its
+    whole genotype buffer for as long as the variant stays in the top-k.
+    """
+
+    __slots__ = (
+        "chrom",
+        "pos",
+        "ref",
+        "alt",
+        "in_cluster_avg",
+        "out_cluster_avg",
+        "score",
+    )
+
+    def __init__(self, variant, in_cluster_avg, out_cluster_avg, score):
+        alt = variant.ALT
+        self.chrom = sys.intern(variant.CHROM)
+        self.pos = variant.POS
+        self.ref = variant.REF
+        self.alt = ",".join(alt) if isinstance(alt, (list, tuple)) else alt
+        self.in_cluster_avg = in_cluster_avg
+        self.out_cluster_avg = out_cluster_avg
+        self.score = score
+
+    def to_dict(self):
+        return {
+            "chr": self.chrom,
+            "pos": self.pos,
+            "ref": self.ref,
+            "alt": self.alt,
+            "in_cluster_avg": self.in_cluster_avg,
+            "out_cluster_avg": self.out_cluster_avg,
+            "score": self.score,
+        }
+
 
 class ClusterProfiler:
     def __init__(self, name: str, idx: List[int], k=20):
@@ -29,24 +71,124 @@ class ClusterProfiler:
         score = abs(in_cluster_avg - out_cluster_avg)
 
         # Prepare record
-        entry = {
-            "variant": variant,
-            "in_cluster_avg": in_cluster_avg,
-            "out_cluster_avg": out_cluster_avg,
-            "score": score,
-        }
+        entry = TopVariant(variant, in_cluster_avg, out_cluster_avg, score)
 
-        # Increment counter to avoid dict comparison if scores tie
+        # Increment counter to avoid entry comparison if scores tie
         self._counter += 1
-        key = (score, self._counter, entry)
+        self._push((score, self._counter, entry))
 
+    def _push(self, key):
         # Maintain top-k heap
         if len(self.topk) < self.k:
             heapq.heappush(self.topk, key)
         else:
             heapq.heappushpop(self.topk, key)
 
+    def merge(self, keys):
+        """Fold (score, counter, entry) keys from another heap into this one.
+
+        Keeping the top-k of the union of shard-local top-k heaps is exact,
+        as long as the counters of different shards keep file order.
+        """
+        for key in keys:
+            self._push(key)
+
     def get_topk(self):
         """Return top-k variants sorted by descending score."""
-        # Extract only the entry dicts, sort by score descending
-        return [item[2] for item in sorted(self.topk, key=lambda x: x[0], reverse=True)]
+        # Extract only the entries, sort by score descending and break
+        # ties by file order so the result does not depend on heap layout
+        return [item[2] for item in sorted(self.topk, key=lambda x: (-x[0], x[1]))]
+
+
+class BatchClusterProfiler:
+    """Feed variants to many ClusterProfilers from one shared dosage buffer.
+
+    Each variant is decoded once into a row of a preallocated int8
+    (block_size x samples) buffer. When the buffer is full, in-cluster
+    sums for every profiler come from a single multiply with the
+    (samples x profilers) membership matrix. Only variants scoring at
+    least the current heap minimum are pushed, in file order and with the
+    same tie counter, so every profiler ends up with exactly the heap
+    ``process_variant`` would have built.
+    """
+
+    def __init__(
+        self, profilers: List[ClusterProfiler], n_samples: int, block_size=2000
+    ):
+        self.profilers = profilers
+        self.n_samples = n_samples
+        self.block_size = block_size
+
+        self.membership = np.zeros((n_samples, len(profilers)), dtype=np.float32)
+        for col, profiler in enumerate(profilers):
+            idx = [i for i in profiler.idx if 0 <= i < n_samples]
+            self.membership[idx, col] = 1
+
+        self.in_count = self.membership.sum(axis=0).astype(np.int64)
+        self.out_count = n_samples - self.in_count
+
+        # Reused for every block
+        self.dosage = np.empty((block_size, n_samples), dtype=np.int8)
+        self._dosage_f32 = np.empty((block_size, n_samples), dtype=np.float32)
+        self._in_sum = np.empty((block_size, len(profilers)), dtype=np.float32)
+        self.variants = []
+
+    def add(self, variant):
+        """Decode one variant into the buffer, scoring the block once full."""
+        gt = variant.genotype.array()
+        row = len(self.variants)
+        np.add(gt[:, 0], gt[:, 1], out=self.dosage[row], casting="unsafe")
+        self.variants.append(variant)
+
+        if len(self.variants) == self.block_size:
+            self.flush()
+
+    def flush(self):
+        """Score the buffered variants against every profiler."""
+        variants = self.variants
+        if not variants:
+            return
+        n = len(variants)
+
+        dosage = self.dosage[:n]
+        dosage_f32 = self._dosage_f32[:n]
+        np.copyto(dosage_f32, dosage)
+
+        # float32 products and sums of small integers are exact here
+        in_sum = np.matmul(dosage_f32, self.membership, out=self._in_sum[:n])
+        in_sum = in_sum.astype(np.float64)
+        total = dosage.sum(axis=1, dtype=np.int64).astype(np.float64)
+        out_sum = total[:, None] - in_sum
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            in_avg = in_sum / self.in_count
+            out_avg = out_sum / self.out_count
+        scores = np.abs(in_avg - out_avg)
+
+        for col, profiler in enumerate(self.profilers):
+            # Avoid division by zero
+            if self.in_count[col] == 0 or self.out_count[col] == 0:
+                continue
+
+            heap = profiler.topk
+            column = scores[:, col]
+            if len(heap) < profiler.k:
+                rows = range(n)
+            else:
+                rows = np.flatnonzero(column >= heap[0][0])
+
+            for row in rows:
+                score = float(column[row])
+                if len(heap) >= profiler.k and score < heap[0][0]:
+                    continue
+                entry = TopVariant(
+                    variants[row],
+                    float(in_avg[row, col]),
+                    float(out_avg[row, col]),
+                    score,
+                )
+                profiler._push((score, profiler._counter + row + 1, entry))
+
+            profiler._counter += n
+
+        self.variants = []
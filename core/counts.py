@@ -0,0 +1,79 @@
+import json
+import os
+import re
+import subprocess
+
+# Variant/sample totals written next to each stage's data file so later
+# stages read them instead of scanning the file again.
+COUNTS_NAME = "counts.json"
+
+# bcftools +counts output lines, e.g. "Number of SNPs:    2500"
+COUNT_KEYS = {
+    "samples": "samples",
+    "SNPs": "snps",
+    "INDELs": "indels",
+    "MNPs": "mnps",
+    "others": "others",
+    "sites": "variants",
+}
+_COUNT_LINE = re.compile(r"^Number of (\w+):\s*(\d+)", re.MULTILINE)
+
+
+def parse_counts(text):
+    return {
+        COUNT_KEYS[name]: int(value)
+        for name, value in _COUNT_LINE.findall(text)
+        if name in COUNT_KEYS
+    }
+
+
+def tee_counts(stream, out_path, chunk_size=1 << 20):
+    """Copy a VCF/BCF stream to ``out_path`` while bcftools +counts reads it.
+
+    Replaces a second +counts pass over the written file.
+    """
+    counter = subprocess.Popen(
+        ["bcftools", "+counts", "-"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    )
+    feeding = True
+    with open(out_path, "wb") as out:
+        for chunk in iter(lambda: stream.read(chunk_size), b""):
+            out.write(chunk)
+            if feeding:
+                try:
+                    counter.stdin.write(chunk)
+                except BrokenPipeError:
+                    # +counts exited early; finish the copy, report its status below
+                    feeding = False
+    try:
+        counter.stdin.close()
+    except BrokenPipeError:
+        pass
+    output = counter.stdout.read().decode()
+    status = counter.wait()
+    if status != 0 or not feeding:
+        raise RuntimeError(
+            f"bcftools +counts failed on {out_path} (exit status {status})"
+        )
+    return parse_counts(output)
+
+
+def write_counts(stage_dir, counts):
+    with open(os.path.join(stage_dir, COUNTS_NAME), "w") as f:
+        json.dump(counts, f, indent=2)
+
+
+def read_counts(stage_dir):
+    """Counts recorded for a stage directory, or None if there are none."""
+    path = os.path.join(stage_dir, COUNTS_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def print_counts(counts):
+    for key, value in counts.items():
+        print(f"Number of {key}: {value}")
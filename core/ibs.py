@@ -0,0 +1,121 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import numpy as np
+from cyvcf2 import VCF
+
+from core.kinship import write_store
+
+try:
+    from threadpoolctl import threadpool_limits
+
+    HAS_THREADPOOLCTL = True
+except ImportError:
+    HAS_THREADPOOLCTL = False
+
+# genotype codes (cyvcf2 gt_types with gts012=True)
+HOM_REF, HET, HOM_ALT, MISSING = 0, 1, 2, 3
+
+# IBS shared between two called genotypes: 2 - |g1 - g2|
+IBS_WEIGHTS = np.array([[2, 1, 0], [1, 2, 1], [0, 1, 2]], dtype=np.float32)
+
+
+def plink_ids(samples):
+    """(FID, IID) pairs the way plink names VCF samples on import."""
+    if samples and all("_" in s for s in samples):
+        return [tuple(s.split("_", 1)) for s in samples]
+    return [(s, s) for s in samples]
+
+
+def iter_genotype_blocks(vcf, block_size=1024):
+    """Yield (samples x markers) uint8 gts012 code blocks of an open VCF.
+
+    One block is decoded at a time, so memory does not grow with the
+    number of markers.
+    """
+    codes = np.empty((block_size, len(vcf.samples)), dtype=np.uint8)
+    n = 0
+    for variant in vcf:
+        codes[n] = variant.gt_types
+        n += 1
+        if n == block_size:
+            yield codes.T
+            n = 0
+    if n:
+        yield codes[:n].T
+
+
+def _tiles(n_samples, tile_size):
+    starts = range(0, n_samples, tile_size)
+    bounds = [(s, min(s + tile_size, n_samples)) for s in starts]
+    return [(a, b) for i, a in enumerate(bounds) for b in bounds[i:]]
+
+
+def ibs_matrix(blocks, n_samples, threads=None, tile_size=1024):
+    """Pairwise IBS similarity over markers called in both samples.
+
+    IBS(i, j) = sum(2 - |g_i - g_j|) / (2 * markers called in both), the
+    same quantity plink reports with ``--distance ibs flat-missing``.
+    Each (samples x markers) code block is turned into per-genotype
+    indicator matrices and its shared-allele and shared-call counts for
+    every pair of sample tiles are added as it arrives, from BLAS matrix
+    products run on a thread pool. BLAS itself is held to one thread per
+    tile while the pool runs (threadpoolctl, installed with
+    scikit-learn); without threadpoolctl the tiles run one after another
+    on a multithreaded BLAS instead.
+    """
+    threads = (threads or os.cpu_count()) if HAS_THREADPOOLCTL else 1
+    shared = np.zeros((n_samples, n_samples), dtype=np.float64)
+    called = np.zeros((n_samples, n_samples), dtype=np.float64)
+    tiles = _tiles(n_samples, tile_size)
+
+    blas = threadpool_limits(1, user_api="blas") if threads > 1 else nullcontext()
+    with blas, ThreadPoolExecutor(max_workers=threads) as pool:
+        for codes in blocks:
+            # (samples x 3 x markers) indicators for genotypes 0, 1 and 2
+            onehot = (codes[:, None, :] == np.arange(3)[None, :, None]).astype(
+                np.float32
+            )
+            weighted = np.einsum("gh,shm->sgm", IBS_WEIGHTS, onehot)
+
+            onehot = onehot.reshape(n_samples, -1)
+            weighted = weighted.reshape(n_samples, -1)
+            present = (codes != MISSING).astype(np.float32)
+
+            def accumulate(tile):
+                (a0, a1), (b0, b1) = tile
+                shared[a0:a1, b0:b1] += weighted[a0:a1] @ onehot[b0:b1].T
+                called[a0:a1, b0:b1] += present[a0:a1] @ present[b0:b1].T
+
+            # tiles are disjoint, so no locking is needed
+            list(pool.map(accumulate, tiles))
+
+    # only tiles on or above the diagonal were computed
+    shared = np.triu(shared) + np.triu(shared, k=1).T
+    called = np.triu(called) + np.triu(called, k=1).T
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.divide(shared, 2 * called, out=shared)
+    np.fill_diagonal(shared, 1.0)
+    return shared
+
+
+def write_ibs(vcf_path, out_path, block_size=1024, threads=None):
+    """Compute IBS for a VCF and write the ``<out>.kin`` store and ``<out>.mibs.id``.
+
+    Genotypes are streamed block by block, so memory depends on the
+    number of samples only.
+    """
+    vcf = VCF(vcf_path, gts012=True)
+    ids = plink_ids(list(vcf.samples))
+    ibs = ibs_matrix(
+        iter_genotype_blocks(vcf, block_size), len(ids), threads=threads
+    )
+    vcf.close()
+
+    row_blocks = (ibs[i : i + 1024] for i in range(0, len(ids), 1024))
+    write_store(f"{out_path}.kin", ids, row_blocks)
+    with open(f"{out_path}.mibs.id", "w") as f:
+        for fid, iid in ids:
+            f.write(f"{fid}\t{iid}\n")
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import subprocess
+
+# Variant file each stage hands to the next, by INTERMEDIATE_FORMAT.
+# "bcf" is BGZF-compressed BCF with a CSI index, read directly by
+# bcftools, cyvcf2 and plink (--bcf) and queryable by region.
+DATA_FILES = {"vcf": "data.vcf", "bcf": "data.bcf"}
+
+
+def intermediate_format(config):
+    fmt = config.get("INTERMEDIATE_FORMAT", "vcf").lower()
+    if fmt not in DATA_FILES:
+        raise ValueError(f"Unknown INTERMEDIATE_FORMAT: {fmt}")
+    return fmt
+
+
+def data_path(base_path, stage, config):
+    """Path of a stage's variant file, e.g. ``<base>/01_merged/data.bcf``."""
+    return os.path.join(base_path, stage, DATA_FILES[intermediate_format(config)])
+
+
+def thread_args(config):
+    threads = int(config.get("BCFTOOLS_THREADS", 0))
+    return ["--threads", str(threads)] if threads else []
+
+
+def output_args(config):
+    """bcftools options that write the configured format."""
+    if intermediate_format(config) == "vcf":
+        return []
+    return ["-Ob", *thread_args(config)]
+
+
+def write_index(path, config):
+    """CSI-index a BCF output; plain VCF outputs are left as they are."""
+    if intermediate_format(config) == "bcf":
+        subprocess.run(
+            ["bcftools", "index", "-f", *thread_args(config), str(path)], check=True
+        )
+
+
+def unlink_stale(path):
+    """Remove ``path`` and its ``.csi`` if either is a symlink.
+
+    An unfiltered run links its output (and index) to the previous
+    stage's file; writing or indexing through the link would overwrite
+    that stage's data instead.
+    """
+    paths = [str(path), f"{path}.csi"]
+    if any(os.path.islink(p) for p in paths):
+        for p in paths:
+            if os.path.lexists(p):
+                os.remove(p)
+
+
+def plink_input_args(path):
+    """plink options that load ``path`` as VCF or BCF."""
+    path = str(path)
+    return ["--bcf" if path.endswith(".bcf") else "--vcf", path]
+
+
+def bfile_prefix(base_path):
+    """plink binary fileset (``.bed/.bim/.fam``) converted from the filtered data."""
+    return os.path.join(base_path, "02_filtered", "data")
+
+
+def _source_record(data):
+    """Size, mtime and SHA-256 of a variant file, following links."""
+    stat = os.stat(data)
+    sha = hashlib.sha256()
+    with open(data, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": sha.hexdigest(),
+    }
+
+
+def record_bfile_source(base_path, config):
+    """Note the digest of the filtered data the binary set was made from."""
+    data = data_path(base_path, "02_filtered", config)
+    with open(f"{bfile_prefix(base_path)}.source.json", "w") as f:
+        json.dump(_source_record(data), f)
+
+
+def bfile_is_current(base_path, data):
+    """Whether the binary set was converted from the current ``data``.
+
+    Compares digests, so a rerun of step 2 that rewrote identical bytes
+    keeps the binary set. The file is hashed only when its size or mtime
+    differ from the record, which is then refreshed.
+    """
+    record_path = f"{bfile_prefix(base_path)}.source.json"
+    if not os.path.exists(record_path):
+        return False
+    with open(record_path) as f:
+        recorded = json.load(f)
+
+    stat = os.stat(data)
+    if [stat.st_size, stat.st_mtime_ns] == [recorded["size"], recorded["mtime_ns"]]:
+        return True
+    current = _source_record(data)
+    if current["sha256"] != recorded["sha256"]:
+        return False
+    with open(record_path, "w") as f:
+        json.dump(current, f)
+    return True
+
+
+def filtered_genotypes(base_path, config):
+    """The plink binary prefix of the filtered data if converted, else its VCF/BCF.
+
+    The fallback covers the conversion step not having run, e.g. when a
+    stage script is called on its own, and a binary set converted from
+    different data, left from before a re-filter.
+    """
+    prefix = bfile_prefix(base_path)
+    data = data_path(base_path, "02_filtered", config)
+    if not all(os.path.exists(f"{prefix}.{ext}") for ext in ("bed", "bim", "fam")):
+        return data
+
+    if os.path.exists(data) and not bfile_is_current(base_path, data):
+        print(f"[WARN] {prefix}.bed was not converted from {data}, reading it instead")
+        return data
+    return prefix
+
+
+def plink_data_args(base_path, config):
+    """plink options that load the filtered data, preferring the binary set."""
+    path = filtered_genotypes(base_path, config)
+    if path == bfile_prefix(base_path):
+        return ["--bfile", path]
+    return plink_input_args(path)
+
+
+def plink_resource_args(config):
+    """--threads/--memory (MB) for plink from PLINK_THREADS/PLINK_MEMORY."""
+    args = []
+    threads = int(config.get("PLINK_THREADS", 0))
+    memory = int(config.get("PLINK_MEMORY", 0))
+    if threads:
+        args += ["--threads", str(threads)]
+    if memory:
+        args += ["--memory", str(memory)]
+    return args
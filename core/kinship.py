@@ -0,0 +1,203 @@
+import json
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+
+# Binary kinship store: magic, header length, JSON header (sample ids,
+# min/max for normalization) padded so the float32 n x n matrix starts on
+# a page boundary and can be memory-mapped row by row.
+STORE_MAGIC = b"KINSHIP1"
+STORE_ALIGN = 4096
+STORE_SLACK = 128  # room for min/max, only known after the rows are written
+
+
+def _store_header(ids, min_k, max_k, offset):
+    header = {
+        "n": len(ids),
+        "dtype": "float32",
+        "offset": offset,
+        "fid": [str(fid) for fid, _ in ids],
+        "iid": [str(iid) for _, iid in ids],
+        "min": min_k,
+        "max": max_k,
+    }
+    return json.dumps(header).encode()
+
+
+def write_store(path, ids, row_blocks):
+    """Write a kinship store from an iterable of (rows x n) blocks."""
+    n = len(ids)
+    prefix_len = len(STORE_MAGIC) + 4
+    header_len = len(_store_header(ids, 0.0, 0.0, 0)) + STORE_SLACK
+    offset = -(-(prefix_len + header_len) // STORE_ALIGN) * STORE_ALIGN
+
+    min_k, max_k = np.inf, -np.inf
+    rows = 0
+    with open(path, "wb") as f:
+        f.seek(offset)
+        for block in row_blocks:
+            block = np.asarray(block, dtype=np.float32).reshape(-1, n)
+            # pairs without shared calls are NaN and left out
+            called = block[~np.isnan(block)]
+            if called.size:
+                min_k = min(min_k, float(called.min()))
+                max_k = max(max_k, float(called.max()))
+            f.write(block.tobytes())
+            rows += len(block)
+
+        if rows != n:
+            raise ValueError(f"Expected {n} kinship rows, got {rows}")
+
+        header = _store_header(ids, min_k, max_k, offset)
+        header = header.ljust(offset - prefix_len)
+        f.seek(0)
+        f.write(STORE_MAGIC + struct.pack("<I", len(header)) + header)
+
+
+# matrix files converted into the store, next to ``out.mibs.id``: plink's
+# text output and the float64 .npy of native runs before they wrote the
+# store directly
+KINSHIP_SOURCES = {"plink": ".mibs", "npy": ".mibs.npy"}
+
+
+def convert_to_store(base_path, source=None):
+    """Write ``out.kin`` from plink's text output or an older native ``.npy``.
+
+    ``source`` is a KINSHIP_SOURCES key; without it the newer of the two
+    files is used.
+    """
+    prefix = f"{base_path}/10_kinship/out"
+    ids = pd.read_csv(f"{prefix}.mibs.id", sep=r"\s+", header=None)
+    ids = list(zip(ids[0], ids[1]))
+
+    if source is None:
+        existing = [
+            name
+            for name, suffix in KINSHIP_SOURCES.items()
+            if os.path.exists(f"{prefix}{suffix}")
+        ]
+        source = max(
+            existing,
+            key=lambda name: os.path.getmtime(f"{prefix}{KINSHIP_SOURCES[name]}"),
+            default="plink",
+        )
+
+    if source == "npy":
+        matrix = np.load(f"{prefix}.mibs.npy", mmap_mode="r")
+        row_blocks = (matrix[i : i + 1024] for i in range(0, len(ids), 1024))
+    else:
+        # stream plink's square text output instead of parsing it whole
+        row_blocks = (
+            chunk.to_numpy()
+            for chunk in pd.read_csv(
+                f"{prefix}.mibs",
+                sep=r"\s+",
+                header=None,
+                dtype=np.float32,
+                chunksize=1024,
+            )
+        )
+
+    write_store(f"{prefix}.kin", ids, row_blocks)
+
+
+class KinshipStore:
+    """Memory-mapped view of a kinship store written by write_store."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            if f.read(len(STORE_MAGIC)) != STORE_MAGIC:
+                raise ValueError(f"{path} is not a kinship store")
+            (header_len,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_len))
+
+        self.path = path
+        self.fids = header["fid"]
+        self.iids = header["iid"]
+        self.min = header["min"]
+        self.max = header["max"]
+        self.index = {iid: i for i, iid in enumerate(self.iids)}
+        self.matrix = np.memmap(
+            path,
+            dtype=np.float32,
+            mode="r",
+            offset=header["offset"],
+            shape=(header["n"], header["n"]),
+        )
+
+    @classmethod
+    def open(cls, base_path):
+        """Open ``10_kinship/out.kin``, converting older outputs once."""
+        path = f"{base_path}/10_kinship/out.kin"
+        if not os.path.exists(path):
+            convert_to_store(base_path)
+        return cls(path)
+
+    def __len__(self):
+        return len(self.iids)
+
+    def scale(self, values):
+        """Min-max scale raw values with the whole-matrix min/max."""
+        return (np.asarray(values, dtype=np.float64) - self.min) / (
+            self.max - self.min
+        )
+
+    def row(self, i, normalized=True):
+        values = self.matrix[i]
+        return self.scale(values) if normalized else np.array(values)
+
+    def value(self, i, j, normalized=True):
+        value = float(self.matrix[i, j])
+        return float(self.scale(value)) if normalized else value
+
+    def normalized(self):
+        """Full normalized matrix in memory."""
+        return self.scale(self.matrix)
+
+
+def _extreme_indices(values, k, largest):
+    """Indices of the k largest (or smallest) values, unordered."""
+    if len(values) <= k:
+        return np.arange(len(values))
+    keyed = -values if largest else values
+    return np.argpartition(keyed, k - 1)[:k]
+
+
+def extreme_pairs(matrix, k=10, block_rows=256):
+    """Top-k and bottom-k sample pairs (i < j) of a symmetric matrix.
+
+    The upper triangle is scanned ``block_rows`` rows at a time, keeping
+    only a running argpartition buffer per end, so memory stays
+    O(block_rows x n + k) instead of materializing all n(n-1)/2 pairs.
+    Returns two (i, j, value) array triples sorted by descending value.
+    """
+    n = matrix.shape[0]
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0))
+    best = {True: empty, False: empty}
+
+    for start in range(0, n - 1, block_rows):
+        block = np.asarray(matrix[start : start + block_rows], dtype=np.float64)
+        # local row r pairs with global columns j > start + r
+        rows, cols = np.triu_indices(len(block), k=start + 1, m=n)
+        values = block[rows, cols]
+        rows += start
+
+        for largest in (True, False):
+            kept_rows, kept_cols, kept_values = best[largest]
+            keep = _extreme_indices(values, k, largest)
+            merged = (
+                np.concatenate([kept_rows, rows[keep]]),
+                np.concatenate([kept_cols, cols[keep]]),
+                np.concatenate([kept_values, values[keep]]),
+            )
+            keep = _extreme_indices(merged[2], k, largest)
+            best[largest] = tuple(a[keep] for a in merged)
+
+    result = []
+    for largest in (True, False):
+        rows, cols, values = best[largest]
+        order = np.argsort(-values, kind="stable")
+        result.append((rows[order], cols[order], values[order]))
+    return result[0], result[1]
@@ -0,0 +1,89 @@
+import numpy as np
+from scipy.sparse.linalg import LinearOperator, eigsh
+
+
+def double_centered(ibs, block_rows=1024):
+    """B = -1/2 J D^2 J for the IBS distances D = 1 - IBS, as float32.
+
+    ``ibs`` may be a memory-mapped kinship matrix; it is read in blocks
+    of ``block_rows`` rows and B is built in place, so the only n x n
+    array in memory is B itself. Missing distances (NaN, pairs without
+    shared calls) are imputed with the mean of the two samples' average
+    distances. Returns (B, number of imputed entries).
+    """
+    n = len(ibs)
+    b = np.empty((n, n), dtype=np.float32)
+    for start in range(0, n, block_rows):
+        block = 1 - np.asarray(ibs[start : start + block_rows], dtype=np.float64)
+        b[start : start + len(block)] = block
+
+    missing = int(np.isnan(b).sum())
+    if missing:
+        called = ~np.isnan(b)
+        with np.errstate(invalid="ignore"):
+            row_means = np.nansum(b, axis=1, dtype=np.float64) / called.sum(axis=1)
+        del called
+        for start in range(0, n, block_rows):
+            block = b[start : start + block_rows]
+            rows, cols = np.nonzero(np.isnan(block))
+            block[rows, cols] = (row_means[start + rows] + row_means[cols]) / 2
+    if not np.isfinite(b).all():
+        raise ValueError(
+            "IBS matrix has samples without any shared calls; "
+            "cannot compute MDS distances for them"
+        )
+    b **= 2
+
+    # D is symmetric, so row and column means are the same
+    means = b.mean(axis=0, dtype=np.float64)
+    grand = means.mean()
+    for start in range(0, n, block_rows):
+        block = b[start : start + block_rows]
+        block -= means[start : start + len(block), None]
+        block -= means[None, :]
+        block += grand
+        block *= -0.5
+    return b, missing
+
+
+def classical_mds(ibs, k, seed=0):
+    """Top-k classical (Torgerson) MDS coordinates of the samples.
+
+    Same construction as ``plink --cluster --mds-plot`` over the IBS
+    distance matrix, but the distances are the ones 10_kinship already
+    computed. Only the k largest eigenpairs of B are found, with ARPACK.
+    Returns (coordinates, eigenvalues, number of imputed distances).
+    """
+    b, imputed = double_centered(ibs)
+    n = len(b)
+    k = min(k, n)
+
+    if k < n - 1:
+        operator = LinearOperator(
+            (n, n),
+            matvec=lambda x: b @ np.asarray(x, dtype=np.float32).ravel(),
+            dtype=np.float64,
+        )
+        v0 = np.random.default_rng(seed).standard_normal(n)
+        values, vectors = eigsh(operator, k=k, which="LA", v0=v0)
+    else:
+        # ARPACK needs k < n - 1; small cohorts are solved exactly
+        values, vectors = np.linalg.eigh(b.astype(np.float64))
+
+    order = np.argsort(values)[::-1][:k]
+    values, vectors = values[order], vectors[:, order]
+
+    # deterministic signs: largest entry of each eigenvector positive
+    signs = np.sign(vectors[np.abs(vectors).argmax(axis=0), range(k)])
+    vectors *= np.where(signs == 0, 1, signs)
+
+    return vectors * np.sqrt(np.clip(values, 0, None)), values, imputed
+
+
+def write_mds(out_path, ids, coordinates):
+    """Write ``out.mds`` with plink's FID IID SOL C1..Ck columns."""
+    dims = [f"C{i + 1}" for i in range(coordinates.shape[1])]
+    with open(out_path, "w") as f:
+        f.write(" ".join(["FID", "IID", "SOL", *dims]) + "\n")
+        for (fid, iid), row in zip(ids, coordinates):
+            f.write(" ".join([fid, iid, "0", *(f"{v:.6g}" for v in row)]) + "\n")
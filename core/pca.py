@@ -0,0 +1,304 @@
+import os
+
+import numpy as np
+import pandas as pd
+from cyvcf2 import VCF
+
+from core.ibs import plink_ids
+
+# PLINK 1 .bed: magic bytes, then one variant per row of 2-bit codes
+BED_MAGIC = bytes([0x6C, 0x1B, 0x01])
+# .bed code -> A1 allele count (01 is missing)
+BED_DOSAGE = np.array([2, np.nan, 1, 0], dtype=np.float32)
+
+
+class GenotypeSource:
+    """Re-readable stream of (variants, dosages) blocks from a VCF/BCF or
+    a plink binary fileset.
+
+    ``variants`` are (chrom, id, a1, a2) tuples and ``dosages`` a
+    (block x samples) float32 array of A1 allele counts, NaN if missing.
+    For VCF/BCF input A1 is the ALT allele, as on plink's import.
+    """
+
+    def __init__(self, path, block_size=1024):
+        self.path = str(path)
+        self.block_size = block_size
+        self.is_bed = os.path.exists(f"{self.path}.bed")
+        if self.is_bed:
+            fam = pd.read_csv(f"{self.path}.fam", sep=r"\s+", header=None, dtype=str)
+            self.ids = list(zip(fam[0], fam[1]))
+        else:
+            self.ids = plink_ids(list(VCF(self.path).samples))
+
+    def blocks(self):
+        return self._bed_blocks() if self.is_bed else self._vcf_blocks()
+
+    def _vcf_blocks(self):
+        vcf = VCF(self.path, gts012=True)
+        codes = np.empty((self.block_size, len(self.ids)), dtype=np.int8)
+        variants = []
+        for variant in vcf:
+            codes[len(variants)] = variant.gt_types
+            chrom, ref = variant.CHROM, variant.REF
+            alt = ",".join(variant.ALT) or "."
+            var_id = variant.ID or f"{chrom}-{variant.POS}-{ref}-{alt}"
+            variants.append((chrom, var_id, alt, ref))
+            if len(variants) == self.block_size:
+                yield variants, _vcf_dosages(codes)
+                variants = []
+        if variants:
+            yield variants, _vcf_dosages(codes[: len(variants)])
+
+    def _bed_blocks(self):
+        bim = pd.read_csv(f"{self.path}.bim", sep=r"\s+", header=None, dtype=str)
+        n = len(self.ids)
+        with open(f"{self.path}.bed", "rb") as f:
+            if f.read(3) != BED_MAGIC:
+                raise ValueError(f"{self.path}.bed is not a variant-major .bed")
+        packed = np.memmap(
+            f"{self.path}.bed",
+            dtype=np.uint8,
+            mode="r",
+            offset=3,
+            shape=(len(bim), (n + 3) // 4),
+        )
+
+        for start in range(0, len(bim), self.block_size):
+            block = np.asarray(packed[start : start + self.block_size])
+            codes = np.stack([(block >> shift) & 3 for shift in (0, 2, 4, 6)], axis=2)
+            rows = bim.iloc[start : start + self.block_size]
+            variants = list(zip(rows[0], rows[1], rows[4], rows[5]))
+            yield variants, BED_DOSAGE[codes.reshape(len(block), -1)[:, :n]]
+
+
+def _vcf_dosages(codes):
+    dosages = codes.astype(np.float32)
+    dosages[codes == 3] = np.nan
+    return dosages
+
+
+def standardize(dosages):
+    """(d - 2p) / sqrt(2p(1 - p)) per variant, missing calls set to 0.
+
+    The same standardization as plink's relationship matrix. Monomorphic
+    or uncalled variants become all-zero rows and are not counted in the
+    returned number of informative variants.
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p = np.nanmean(dosages, axis=1, keepdims=True) / 2
+        scale = np.sqrt(2 * p * (1 - p))
+        std = (dosages - 2 * p) / scale
+    valid = (scale[:, 0] > 0) & np.isfinite(scale[:, 0])
+    std[~valid] = 0
+    np.nan_to_num(std, copy=False)
+    return std.astype(np.float32, copy=False), int(valid.sum())
+
+
+def randomized_pca(source, k, oversample=10, power_iterations=2, seed=0):
+    """Top-k eigenpairs of the GRM X X^T / M from streamed blocks.
+
+    Halko-Martinsson-Tropp randomized range finder on the (samples x
+    variants) standardized matrix X, which is never held in memory: each
+    pass reads the blocks once and only (samples x (k + oversample))
+    matrices are kept. Passes: one for the sketch, one per power
+    iteration and one for the projected Gram matrix.
+    Returns (eigenvectors, eigenvalues, singular values of X).
+    """
+    n = len(source.ids)
+    k = min(k, n)
+    width = min(k + oversample, n)
+
+    y = np.zeros((n, width))
+    n_variants = 0
+    for i, (_, dosages) in enumerate(source.blocks()):
+        g, valid = standardize(dosages)
+        n_variants += valid
+        # per-block seed so the sketch does not depend on the block count
+        omega = np.random.default_rng([seed, i]).standard_normal((len(g), width))
+        y += g.T @ omega.astype(np.float32)
+    if not n_variants:
+        raise ValueError("No polymorphic variants to compute PCA from")
+
+    for _ in range(power_iterations):
+        q = np.linalg.qr(y)[0].astype(np.float32)
+        y = np.zeros((n, width))
+        for _, dosages in source.blocks():
+            g, _ = standardize(dosages)
+            y += g.T @ (g @ q)
+
+    q = np.linalg.qr(y)[0].astype(np.float32)
+    gram = np.zeros((width, width))
+    for _, dosages in source.blocks():
+        g, _ = standardize(dosages)
+        t = (g @ q).astype(np.float64)
+        gram += t.T @ t
+
+    values, vectors = np.linalg.eigh(gram)
+    order = np.argsort(values)[::-1][:k]
+    values = np.clip(values[order], 0, None)
+    eigenvectors = q.astype(np.float64) @ vectors[:, order]
+
+    # deterministic signs: largest entry of each eigenvector positive
+    signs = np.sign(eigenvectors[np.abs(eigenvectors).argmax(axis=0), range(k)])
+    eigenvectors *= np.where(signs == 0, 1, signs)
+
+    return eigenvectors, values / n_variants, np.sqrt(values)
+
+
+def write_pca(source, out_prefix, eigenvectors, eigenvalues, singular_values):
+    """Write ``.eigenvec``, ``.eigenval`` and ``.eigenvec.var`` like
+    ``plink --pca N var-wts header``.
+
+    Variant weights are the unit-norm loadings X^T u / s, so a sample's
+    eigenvector entry is its standardized genotypes dotted with the
+    weights, divided by the singular value s = sqrt(M * eigenvalue).
+    """
+    k = eigenvectors.shape[1]
+    pcs = [f"PC{i + 1}" for i in range(k)]
+
+    with open(f"{out_prefix}.eigenvec", "w") as f:
+        f.write(" ".join(["FID", "IID", *pcs]) + "\n")
+        for (fid, iid), row in zip(source.ids, eigenvectors):
+            f.write(" ".join([fid, iid, *(f"{v:.6g}" for v in row)]) + "\n")
+
+    with open(f"{out_prefix}.eigenval", "w") as f:
+        f.writelines(f"{v:.6g}\n" for v in eigenvalues)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        inverse = np.where(singular_values > 0, 1 / singular_values, 0)
+    freqs = []
+    with open(f"{out_prefix}.eigenvec.var", "w") as f:
+        f.write(" ".join(["CHR", "VAR", "A1", "A2", *pcs]) + "\n")
+        for variants, dosages in source.blocks():
+            g, _ = standardize(dosages)
+            with np.errstate(invalid="ignore"):
+                freqs.append(np.nanmean(dosages, axis=1) / 2)
+            weights = (g.astype(np.float64) @ eigenvectors) * inverse
+            for variant, row in zip(variants, weights):
+                f.write(" ".join([*variant, *(f"{v:.6g}" for v in row)]) + "\n")
+
+    save_projection_model(out_prefix, np.concatenate(freqs), inverse)
+
+
+# ---------------------------
+# Projection of new samples onto saved variant weights
+# ---------------------------
+MODEL_SUFFIX = ".eigenvec.model.npz"
+# FID/IID of the rows scripts/pca_project.py appended to ``.eigenvec``
+PROJECTED_SUFFIX = ".eigenvec.projected"
+
+
+def save_projection_model(out_prefix, freqs, scale):
+    """Reference A1 frequencies and per-PC scale for project_samples."""
+    np.savez(f"{out_prefix}{MODEL_SUFFIX}", freq=freqs, scale=scale)
+
+
+def load_projection_model(out_prefix):
+    model = np.load(f"{out_prefix}{MODEL_SUFFIX}")
+    return model["freq"], model["scale"]
+
+
+def projected_ids(out_prefix):
+    """(FID, IID) of the projected samples in ``.eigenvec``, as a set."""
+    path = f"{out_prefix}{PROJECTED_SUFFIX}"
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {tuple(line.split()) for line in f if line.strip()}
+
+
+def read_variant_weights(path):
+    """``.eigenvec.var`` as (table of CHR/VAR/A1/A2, weights matrix)."""
+    df = pd.read_csv(path, sep=r"\s+", dtype={"CHR": str, "VAR": str})
+    pcs = [col for col in df.columns if col.startswith("PC")]
+    return df[["CHR", "VAR", "A1", "A2"]], df[pcs].to_numpy(dtype=np.float64)
+
+
+def _standardize_with(dosages, freqs):
+    """standardize() with fixed (reference) A1 frequencies."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scale = np.sqrt(2 * freqs * (1 - freqs))[:, None]
+        std = (dosages - 2 * freqs[:, None]) / scale
+    std[~(scale[:, 0] > 0)] = 0
+    return np.nan_to_num(std, copy=False)
+
+
+def fit_projection_model(source, out_prefix, eigenvectors):
+    """Build the projection model for weights not written by write_pca.
+
+    One pass over the reference genotypes, in ``.eigenvec.var`` order,
+    gives the A1 frequencies and each reference sample's raw score; the
+    per-PC scale is the least-squares fit of those scores onto the saved
+    eigenvectors, so any per-PC weight scaling (plink's) is absorbed.
+    """
+    table, weights = read_variant_weights(f"{out_prefix}.eigenvec.var")
+    freqs = []
+    scores = np.zeros((len(source.ids), weights.shape[1]))
+    start = 0
+    for variants, dosages in source.blocks():
+        rows = table.iloc[start : start + len(variants)]
+        if list(rows["VAR"]) != [v[1] for v in variants]:
+            raise ValueError("Reference genotypes do not match .eigenvec.var order")
+        # count the allele the weights call A1
+        flip = (rows["A1"].to_numpy() != np.array([v[2] for v in variants]))[:, None]
+        dosages = np.where(flip, 2 - dosages, dosages)
+
+        with np.errstate(invalid="ignore"):
+            block_freqs = np.nanmean(dosages, axis=1) / 2
+        freqs.append(block_freqs)
+        std = _standardize_with(dosages, block_freqs)
+        scores += std.T @ weights[start : start + len(variants)]
+        start += len(variants)
+
+    scale = (scores * eigenvectors).sum(axis=0) / (scores * scores).sum(axis=0)
+    save_projection_model(out_prefix, np.concatenate(freqs), scale)
+
+
+def project_samples(vcf_path, out_prefix, block_size=1024):
+    """PC coordinates of the samples in ``vcf_path`` from saved weights.
+
+    Variants are matched on CHROM-POS-REF-ALT (either allele order) to the
+    VAR column; reference variants absent from the file count as the
+    reference mean. Returns (sample ids, coordinates, matched variants).
+    """
+    table, weights = read_variant_weights(f"{out_prefix}.eigenvec.var")
+    freqs, scale = load_projection_model(out_prefix)
+    index = {var: i for i, var in enumerate(table["VAR"])}
+    a1 = table["A1"].to_numpy()
+
+    vcf = VCF(vcf_path, gts012=True)
+    ids = plink_ids(list(vcf.samples))
+    scores = np.zeros((len(ids), weights.shape[1]))
+    matched = 0
+
+    rows, flips, codes = [], [], []
+    for variant in vcf:
+        if len(variant.ALT) != 1:
+            continue
+        chrom, pos, ref, alt = variant.CHROM, variant.POS, variant.REF, variant.ALT[0]
+        i = index.get(f"{chrom}-{pos}-{ref}-{alt}")
+        if i is None:
+            i = index.get(f"{chrom}-{pos}-{alt}-{ref}")
+        if i is None or a1[i] not in (ref, alt):
+            continue
+        rows.append(i)
+        flips.append(a1[i] != alt)
+        codes.append(variant.gt_types.copy())
+        if len(rows) == block_size:
+            scores += _project_block(rows, flips, codes, freqs, weights)
+            matched += len(rows)
+            rows, flips, codes = [], [], []
+    if rows:
+        scores += _project_block(rows, flips, codes, freqs, weights)
+        matched += len(rows)
+
+    return ids, scores * scale, matched
+
+
+def _project_block(rows, flips, codes, freqs, weights):
+    rows = np.array(rows)
+    dosages = _vcf_dosages(np.array(codes, dtype=np.int8))
+    dosages = np.where(np.array(flips)[:, None], 2 - dosages, dosages)
+    std = _standardize_with(dosages, freqs[rows])
+    return std.T @ weights[rows]
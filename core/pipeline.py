@@ -0,0 +1,417 @@
+import ast
+import hashlib
+import json
+import os
+import resource
+import sys
+import time
+import traceback
+
+MANIFEST_NAME = ".pipeline_manifest.json"
+
+
+class Step:
+    """A pipeline stage and what its result depends on.
+
+    ``inputs`` and ``outputs`` are paths relative to the base path (files
+    or directories), ``env`` lists the configuration variables that change
+    the result and ``code`` the repo files besides the script itself and
+    the ``core`` modules it imports, which are found by core_imports.
+    ``after`` names the steps that must finish first and ``cpus`` how much
+    of the scheduler's CPU budget the step occupies while running.
+    """
+
+    def __init__(
+        self,
+        step_id,
+        description,
+        script,
+        inputs=(),
+        outputs=(),
+        env=(),
+        code=(),
+        after=(),
+        cpus=1,
+        cache=True,
+    ):
+        self.step_id = step_id
+        self.description = description
+        self.script = script
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.env = list(env)
+        self.code = list(dict.fromkeys([script, *core_imports(script), *code]))
+        self.after = list(after)
+        self.cpus = cpus
+        self.cache = cache
+
+
+def core_imports(script):
+    """``core/*.py`` files a script imports, directly or through other
+    ``core`` modules, as paths next to the script."""
+    root = os.path.dirname(script)
+    found = []
+    pending = [script]
+    while pending:
+        with open(pending.pop()) as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ImportFrom) and node.module == "core":
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module:
+                modules = [node.module]
+            elif isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            else:
+                continue
+            for module in modules:
+                module = module.removeprefix("core.")
+                path = os.path.normpath(os.path.join(root, "core", f"{module}.py"))
+                if "." not in module and path not in found and os.path.isfile(path):
+                    found.append(path)
+                    pending.append(path)
+    return found
+
+
+class StepCache:
+    """Manifest of the input/config hash each step last succeeded with.
+
+    File digests are remembered by (size, mtime) so unchanged multi-GB
+    VCFs are hashed only once.
+    """
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self.path = os.path.join(base_path, MANIFEST_NAME)
+        self.manifest = {"steps": {}, "files": {}}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.manifest = json.load(f)
+
+    def file_digest(self, path):
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        cached = self.manifest["files"].get(path)
+        if cached and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        self.manifest["files"][path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def path_digest(self, path):
+        """Digest of a file, or of every file under a directory."""
+        if os.path.isfile(path):
+            return self.file_digest(path)
+        if not os.path.isdir(path):
+            return "missing"
+
+        sha = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                sha.update(os.path.relpath(full, path).encode())
+                sha.update(self.file_digest(full).encode())
+        return sha.hexdigest()
+
+    def step_key(self, step):
+        sha = hashlib.sha256()
+        for path in step.code:
+            sha.update(f"code:{path}:{self.path_digest(path)}\n".encode())
+        for path in step.inputs:
+            digest = self.path_digest(os.path.join(self.base_path, path))
+            sha.update(f"input:{path}:{digest}\n".encode())
+        for name in sorted(step.env):
+            sha.update(f"env:{name}={os.environ.get(name, '')}\n".encode())
+        return sha.hexdigest()
+
+    def is_fresh(self, step, key):
+        recorded = self.manifest["steps"].get(str(step.step_id))
+        if not recorded or recorded["key"] != key:
+            return False
+        return all(
+            os.path.exists(os.path.join(self.base_path, path)) for path in step.outputs
+        )
+
+    def record(self, step, key):
+        self.manifest["steps"][str(step.step_id)] = {"key": key}
+        self.save()
+
+    def save(self):
+        os.makedirs(self.base_path, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+class StepFailed(Exception):
+    def __init__(self, step, returncode, metrics=None):
+        super().__init__(f"{step.description} failed with exit code {returncode}")
+        self.step = step
+        self.returncode = returncode
+        self.metrics = metrics
+
+
+def proc_io(pid="self"):
+    """Counters of ``/proc/<pid>/io``, or None where there is no such file.
+
+    They include every descendant the process has waited for. An exited
+    child can still be read until it is reaped (waitid with WNOWAIT).
+    ``read_bytes``/``write_bytes`` are storage traffic and ``rchar``/
+    ``wchar`` every byte passed to read/write calls, page-cache hits
+    included.
+    """
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            return {key: int(value) for key, value in (line.split(":") for line in f)}
+    except OSError:
+        return None
+
+
+def _io_metrics(io, in_blocks, out_blocks):
+    if io is None:
+        # no /proc (macOS): rusage's 512-byte block counts, disk traffic only
+        return {"read_blocks": in_blocks, "write_blocks": out_blocks}
+    return {
+        "read_bytes": io["read_bytes"],
+        "write_bytes": io["write_bytes"],
+        "read_chars": io["rchar"],
+        "write_chars": io["wchar"],
+    }
+
+
+def usage_metrics(rusage, wall_seconds, io=None):
+    """Resource usage of one finished step from its wait4() rusage.
+
+    The rusage, and ``io`` (its proc_io read before reaping), cover the
+    step's process and every descendant it waited for (plink, bcftools,
+    ...).
+    """
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss_unit = 1 if sys.platform == "darwin" else 1024
+    return {
+        "wall_seconds": wall_seconds,
+        "user_seconds": rusage.ru_utime,
+        "system_seconds": rusage.ru_stime,
+        "max_rss_bytes": rusage.ru_maxrss * rss_unit,
+        **_io_metrics(io, rusage.ru_inblock, rusage.ru_oublock),
+    }
+
+
+def in_process_metrics(before, after, wall_seconds):
+    """usage_metrics for a step run inside the runner's own process.
+
+    ``before``/``after`` are (RUSAGE_SELF, RUSAGE_CHILDREN, proc_io)
+    triples. CPU and I/O are deltas; peak RSS is the larger of the two
+    high-water marks, which cannot be reset between steps.
+    """
+    rss_unit = 1 if sys.platform == "darwin" else 1024
+    rusage_before, rusage_after = before[:2], after[:2]
+
+    def delta(field):
+        return sum(
+            getattr(a, field) - getattr(b, field)
+            for b, a in zip(rusage_before, rusage_after)
+        )
+
+    io = None
+    if before[2] is not None and after[2] is not None:
+        io = {key: after[2][key] - before[2][key] for key in after[2]}
+
+    return {
+        "wall_seconds": wall_seconds,
+        "user_seconds": delta("ru_utime"),
+        "system_seconds": delta("ru_stime"),
+        "max_rss_bytes": max(usage.ru_maxrss for usage in rusage_after) * rss_unit,
+        **_io_metrics(io, delta("ru_inblock"), delta("ru_oublock")),
+    }
+
+
+class RunReport:
+    """Per-step status and resource usage, written as run_report.json."""
+
+    def __init__(self, base_path):
+        self.path = os.path.join(base_path, "run_report.json")
+        self.started = time.time()
+        self.steps = []
+
+    def add(self, step, status, metrics=None):
+        self.steps.append(
+            {
+                "step": step.step_id,
+                "description": step.description,
+                "status": status,
+                **(metrics or {}),
+            }
+        )
+
+    def write(self):
+        report = {
+            "started": time.strftime(
+                "%Y-%m-%dT%H:%M:%S", time.localtime(self.started)
+            ),
+            "wall_seconds": time.time() - self.started,
+            "steps": self.steps,
+        }
+        with open(self.path, "w") as f:
+            json.dump(report, f, indent=2)
+
+    def print_table(self):
+        header = (
+            f"{'Step':<28} {'Status':<8} {'Wall':>8} {'CPU':>8} "
+            f"{'Peak RSS':>10} {'Read':>10} {'Written':>10}"
+        )
+        print(header)
+        print("-" * len(header))
+        for entry in self.steps:
+            if "wall_seconds" not in entry:
+                print(f"{entry['description']:<28} {entry['status']:<8}")
+                continue
+            cpu = entry["user_seconds"] + entry["system_seconds"]
+            print(
+                f"{entry['description']:<28} {entry['status']:<8} "
+                f"{entry['wall_seconds']:7.1f}s {cpu:7.1f}s "
+                f"{_mb(entry['max_rss_bytes']):>10} {_io(entry, 'read'):>10} "
+                f"{_io(entry, 'write'):>10}"
+            )
+        print(f"Total wall time: {time.time() - self.started:.1f}s")
+
+
+def _mb(n_bytes):
+    return f"{n_bytes / (1 << 20):.1f} MB"
+
+
+def _io(entry, direction):
+    if f"{direction}_bytes" in entry:
+        return _mb(entry[f"{direction}_bytes"])
+    return f"{entry[f'{direction}_blocks']} blk"
+
+
+def run_graph(steps, cpus, prepare, launch, finish):
+    """Run steps as a dependency graph, independent ones concurrently.
+
+    ``prepare(step)`` is called once a step's dependencies are done and
+    returns False to skip it. ``launch(step)`` starts it and returns its
+    Popen, and ``finish(step, metrics)`` is called after it succeeds with
+    its usage_metrics.
+    Steps start while their ``cpus`` fit in the budget; one too big for
+    the budget still runs, alone. On the first failure the running steps
+    are terminated and StepFailed is raised.
+    """
+    ids = {step.step_id for step in steps}
+    pending = list(steps)
+    done = set()
+    running = {}  # pid -> (step, popen, start time)
+    metrics = {}
+
+    def ready(step):
+        return all(dep in done or dep not in ids for dep in step.after)
+
+    while pending or running:
+        used = sum(step.cpus for step, _, _ in running.values())
+
+        for step in list(pending):
+            if not ready(step):
+                continue
+            if running and used + step.cpus > cpus:
+                continue
+            pending.remove(step)
+
+            if not prepare(step):
+                done.add(step.step_id)
+                continue
+
+            proc = launch(step)
+            running[proc.pid] = (step, proc, time.monotonic())
+            used += step.cpus
+
+        if not running:
+            if pending and not any(ready(step) for step in pending):
+                raise ValueError("Pipeline steps have a dependency cycle")
+            continue
+
+        # peek at the exited child so its /proc io is read before reaping;
+        # wait4 reports each child's own usage even with steps overlapping
+        pid = os.waitid(os.P_ALL, 0, os.WEXITED | os.WNOWAIT).si_pid
+        io = proc_io(pid)
+        pid, status, rusage = os.wait4(pid, 0)
+        if pid not in running:
+            continue
+        step, proc, started = running.pop(pid)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        metrics[step.step_id] = usage_metrics(
+            rusage, time.monotonic() - started, io
+        )
+
+        if proc.returncode != 0:
+            for _, other, _ in running.values():
+                other.terminate()
+            for _, other, _ in running.values():
+                other.wait()
+            raise StepFailed(step, proc.returncode, metrics[step.step_id])
+
+        done.add(step.step_id)
+        finish(step, metrics[step.step_id])
+
+    return metrics
+
+
+def _usage():
+    return (
+        resource.getrusage(resource.RUSAGE_SELF),
+        resource.getrusage(resource.RUSAGE_CHILDREN),
+        proc_io(),
+    )
+
+
+def run_in_process(steps, prepare, execute, finish):
+    """Run steps one at a time inside this process, in dependency order.
+
+    Same callbacks as run_graph, except ``execute(step)`` runs the step
+    to completion. Exceptions and non-zero SystemExit raise StepFailed.
+    """
+    ids = {step.step_id for step in steps}
+    pending = list(steps)
+    done = set()
+
+    while pending:
+        step = next(
+            (
+                step
+                for step in pending
+                if all(dep in done or dep not in ids for dep in step.after)
+            ),
+            None,
+        )
+        if step is None:
+            raise ValueError("Pipeline steps have a dependency cycle")
+        pending.remove(step)
+
+        if not prepare(step):
+            done.add(step.step_id)
+            continue
+
+        before = _usage()
+        started = time.monotonic()
+        returncode = 0
+        try:
+            execute(step)
+        except SystemExit as e:
+            if e.code not in (0, None):
+                returncode = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            traceback.print_exc()
+            returncode = 1
+        metrics = in_process_metrics(before, _usage(), time.monotonic() - started)
+
+        if returncode != 0:
+            raise StepFailed(step, returncode, metrics)
+
+        done.add(step.step_id)
+        finish(step, metrics)
@@ -0,0 +1,100 @@
+import numpy as np
+
+
+class StreamingStats:
+    """Constant-memory summary of one variable fed in chunks.
+
+    Keeps the count, running mean/variance (merged per chunk with Chan's
+    update), min/max and a fixed-bin histogram over ``[lo, hi]``. The
+    histogram is fine enough to serve as the quantile sketch: quantiles
+    are interpolated within a bin, so their error is at most one bin
+    width. Values outside the range are counted in the edge bins.
+    """
+
+    def __init__(self, lo, hi, bins=2000):
+        self.edges = np.linspace(lo, hi, bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+
+        n = len(values)
+        mean = values.mean()
+        m2 = ((values - mean) ** 2).sum()
+        delta = mean - self.mean
+        total = self.n + n
+        self.m2 += m2 + delta**2 * self.n * n / total
+        self.mean += delta * n / total
+        self.n = total
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+
+        clipped = np.clip(values, self.edges[0], self.edges[-1])
+        self.counts += np.histogram(clipped, bins=self.edges)[0]
+
+    @property
+    def std(self):
+        # sample standard deviation, as pandas' describe()
+        return np.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else np.nan
+
+    def quantile(self, q):
+        if not self.n:
+            return np.nan
+        rank = q * self.n
+        cumulative = np.cumsum(self.counts)
+        i = min(int(np.searchsorted(cumulative, rank)), len(self.counts) - 1)
+        before = cumulative[i - 1] if i else 0
+        fraction = (rank - before) / self.counts[i] if self.counts[i] else 0.0
+        value = self.edges[i] + fraction * (self.edges[i + 1] - self.edges[i])
+        return float(np.clip(value, self.min, self.max))
+
+    def describe(self):
+        """Same rows as ``pandas.Series.describe()``."""
+        empty = not self.n
+        return {
+            "count": float(self.n),
+            "mean": np.nan if empty else self.mean,
+            "std": self.std,
+            "min": np.nan if empty else self.min,
+            "25%": self.quantile(0.25),
+            "50%": self.quantile(0.5),
+            "75%": self.quantile(0.75),
+            "max": np.nan if empty else self.max,
+        }
+
+    def histogram(self, bins=20):
+        """(counts, edges) merged down to ``bins`` bins."""
+        step = len(self.counts) // bins
+        return (
+            self.counts[: step * bins].reshape(bins, step).sum(axis=1),
+            self.edges[: step * bins + 1 : step],
+        )
+
+    def kde(self):
+        """(x, density) from the histogram smoothed with a Gaussian kernel.
+
+        Uses Scott's rule for the bandwidth, like seaborn's default.
+        """
+        width = self.edges[1] - self.edges[0]
+        centers = self.edges[:-1] + width / 2
+        if self.n < 2 or not self.std > 0:
+            return centers, np.zeros_like(centers, dtype=np.float64)
+
+        bandwidth = self.std * self.n ** (-1 / 5)
+        sigma = bandwidth / width
+        # at most as long as the histogram, so mode="same" keeps its length
+        half = int(min(np.ceil(4 * sigma), (len(self.counts) - 1) // 2))
+        offsets = np.arange(-half, half + 1)
+        kernel = np.exp(-0.5 * (offsets / sigma) ** 2)
+        kernel /= kernel.sum()
+
+        smoothed = np.convolve(self.counts, kernel, mode="same")
+        return centers, smoothed / (self.n * width)
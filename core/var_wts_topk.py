@@ -1,42 +1,144 @@
-import pandas as pd
 import json
 
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
 
-def extract_topk(var_file, k=100):
-    df = pd.read_csv(var_file, sep=r"\s+")
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
 
-    pca_columns = [col for col in df.columns if col.startswith("PC")]
-    output = {}
+_VAR_ID = r"^([^-]*)-([+-]?\d+)-([^-]*)-([^-]*)$"
+
+
+def _layout(var_file):
+    """PC column names, delimiter and the length of the first data row."""
+    with open(var_file) as f:
+        header = f.readline()
+        row = f.readline()
+    pcs = [col for col in header.split() if col.startswith("PC")]
+    return pcs, "\t" if "\t" in header else " ", max(len(row), 1)
+
+
+def iter_weights(var_file, chunk_size=100_000):
+    """(VAR ids, PC weight matrix) of an ``.eigenvec.var``, about
+    ``chunk_size`` rows at a time.
+
+    Only VAR and the PC columns are parsed, with pyarrow's streaming CSV
+    reader when installed.
+    """
+    pcs, delimiter, row_bytes = _layout(var_file)
+
+    if HAS_PYARROW:
+        reader = pa_csv.open_csv(
+            var_file,
+            read_options=pa_csv.ReadOptions(
+                block_size=max(chunk_size * row_bytes, 1 << 20)
+            ),
+            parse_options=pa_csv.ParseOptions(delimiter=delimiter),
+            convert_options=pa_csv.ConvertOptions(
+                include_columns=["VAR", *pcs],
+                column_types={"VAR": pa.string(), **dict.fromkeys(pcs, pa.float64())},
+            ),
+        )
+        for batch in reader:
+            ids = batch.column("VAR").to_numpy(zero_copy_only=False)
+            weights = [batch.column(pc).to_numpy(zero_copy_only=False) for pc in pcs]
+            yield ids, np.column_stack(weights).reshape(len(ids), len(pcs))
+    else:
+        chunks = pd.read_csv(
+            var_file,
+            sep=r"\s+",
+            usecols=["VAR", *pcs],
+            dtype={"VAR": str},
+            chunksize=chunk_size,
+        )
+        for df in chunks:
+            yield df["VAR"].to_numpy(), df[pcs].to_numpy(dtype=np.float64)
+
+
+def top_rows(weights, k):
+    """Row indices of the ``k`` largest absolute weights per column.
+
+    One ``argpartition`` over all columns, then only the ``k`` picked rows
+    are sorted, largest first. NaN weights rank last.
+    """
+    keys = -np.abs(weights)
+    if k < len(keys):
+        rows = np.argpartition(keys, k - 1, axis=0)[:k] if k > 0 else keys[:0]
+    else:
+        rows = np.broadcast_to(np.arange(len(keys))[:, None], keys.shape)
+    # back in row order, so the stable sort keeps ties in file order
+    rows = np.sort(rows.astype(np.intp), axis=0)
+    order = np.argsort(np.take_along_axis(keys, rows, axis=0), axis=0, kind="stable")
+    return np.take_along_axis(rows, order, axis=0)
 
-    for pc in pca_columns:
-        abs_col = f"ABS_{pc}"
-        df[abs_col] = df[pc].abs()
-
-        top_snps = df.sort_values(abs_col, ascending=False).head(k)
-
-        output[pc] = []
-        for _, row in top_snps.iterrows():
-            var = row["VAR"]
-            try:
-                chrom, pos, ref, alt = var.split("-")
-                pos = int(pos)
-            except ValueError:
-                chrom, pos, ref, alt = None, None, None, None
-
-            output[pc].append(
-                {
-                    "chrom": chrom,
-                    "pos": pos,
-                    "ref": ref,
-                    "alt": alt,
-                    "score": row[pc],
-                }
-            )
+
+def parse_var_ids(ids):
+    """Split CHROM-POS-REF-ALT ids into chrom/pos/ref/alt lists.
+
+    Ids not of that form get None in every field.
+    """
+    parts = pd.Series(ids, dtype=object).astype(str).str.extract(_VAR_ID)
+    valid = parts.notna().all(axis=1)
+
+    def field(values, convert=str):
+        return [convert(v) if ok else None for v, ok in zip(values, valid)]
+
+    return field(parts[0]), field(parts[1], int), field(parts[2]), field(parts[3])
+
+
+def extract_topk(var_file, k=100, chunk_size=100_000):
+    """Top ``k`` variants by absolute weight for every PC.
+
+    The file is streamed in chunks and merged into a running buffer of
+    the best ``k`` rows per PC, so memory stays at one chunk plus
+    ``k`` x PCs, however many variants were weighted.
+    """
+    pcs = _layout(var_file)[0]
+    best = np.empty((0, len(pcs)))
+    best_ids = np.empty((0, len(pcs)), dtype=object)
+
+    for ids, weights in iter_weights(var_file, chunk_size):
+        # candidates: the buffer's rows first, then the chunk's
+        merged = np.concatenate([best, weights])
+        rows = top_rows(merged, k)
+        from_chunk = rows >= len(best)
+
+        picked = np.empty(rows.shape, dtype=object)
+        picked[from_chunk] = ids[rows[from_chunk] - len(best)]
+        if len(best):
+            kept = np.take_along_axis(best_ids, np.where(from_chunk, 0, rows), axis=0)
+            picked[~from_chunk] = kept[~from_chunk]
+
+        best = np.take_along_axis(merged, rows, axis=0)
+        best_ids = picked
+
+    # each selected variant's id is parsed once, whatever the number of PCs
+    codes, unique = pd.factorize(best_ids.ravel())
+    chrom, pos, ref, alt = parse_var_ids(unique)
+    codes = codes.reshape(best_ids.shape)
+
+    output = {}
+    for j, pc in enumerate(pcs):
+        output[pc] = [
+            {
+                "chrom": chrom[u],
+                "pos": pos[u],
+                "ref": ref[u],
+                "alt": alt[u],
+                "score": score,
+            }
+            for u, score in zip(codes[:, j], best[:, j].tolist())
+        ]
 
     return output
 
 
-def write_topk_json(var_file, out_file, k=100):
-    result = extract_topk(var_file, k=k)
+def write_topk_json(var_file, out_file, k=100, chunk_size=100_000):
+    result = extract_topk(var_file, k=k, chunk_size=chunk_size)
     with open(out_file, "w") as f:
         json.dump(result, f, indent=2)
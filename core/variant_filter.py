@@ -0,0 +1,216 @@
+import ast
+import operator
+import re
+
+import numpy as np
+import pandas as pd
+from cyvcf2 import VCF, Writer
+
+# Streaming variant filter. Expressions are "&&"-joined comparisons like
+# bcftools -i ("MAF>0.01 && F_MISSING<0.1"); the left side is an INFO
+# field, QUAL, or a quantity computed from the genotypes of a chunk:
+#   GT_MAF, GT_MISSING                   over all samples
+#   GROUP_MAF_MIN/MAX, GROUP_MISSING_MIN/MAX
+#                                        min/max over the sample groups
+# Missing values never pass, as in bcftools.
+
+COMPARISONS = {
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+}
+
+GENOTYPE_FIELDS = {"GT_MAF", "GT_MISSING"}
+GROUP_FIELDS = {
+    "GROUP_MAF_MIN": ("maf", np.min),
+    "GROUP_MAF_MAX": ("maf", np.max),
+    "GROUP_MISSING_MIN": ("missing", np.min),
+    "GROUP_MISSING_MAX": ("missing", np.max),
+}
+
+_PREDICATE = re.compile(r"^\s*(\w+)\s*(<=|>=|==|!=|<|>)\s*(.+?)\s*$")
+_ARITHMETIC = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+}
+
+# cyvcf2 var_type -> key in the counts summary (see core.counts)
+TYPE_COUNTS = {"snp": "snps", "indel": "indels", "mnp": "mnps"}
+
+# gts012 genotype codes
+HOM_REF, HET, HOM_ALT, UNKNOWN = 0, 1, 2, 3
+
+
+def _number(text):
+    """Evaluate a constant such as ``0.05`` or ``(1/490)``."""
+
+    def evaluate(node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return node.value
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return -evaluate(node.operand)
+        if isinstance(node, ast.BinOp) and type(node.op) in _ARITHMETIC:
+            return _ARITHMETIC[type(node.op)](evaluate(node.left), evaluate(node.right))
+        raise ValueError(f"Not a number: {text}")
+
+    try:
+        return float(evaluate(ast.parse(text, mode="eval").body))
+    except (SyntaxError, ZeroDivisionError) as e:
+        raise ValueError(f"Not a number: {text}") from e
+
+
+class Predicate:
+    def __init__(self, text):
+        match = _PREDICATE.match(text)
+        if not match:
+            raise ValueError(f"Cannot parse filter predicate: {text.strip()}")
+        self.text = text.strip()
+        self.field, op, value = match.groups()
+        self.compare = COMPARISONS[op]
+        self.value = _number(value)
+
+    def evaluate(self, values):
+        # NaN != x is True, but a missing value must not pass
+        with np.errstate(invalid="ignore"):
+            return self.compare(values, self.value) & ~np.isnan(values)
+
+
+def parse_filter(expr):
+    if "||" in expr:
+        raise ValueError("Only '&&' is supported between filter predicates")
+    return [Predicate(part) for part in expr.split("&&")]
+
+
+def load_groups(groups_path, samples):
+    """Sample index arrays per group from a TSV whose last column is the group.
+
+    Matches on the IID column (a 30_cluster ``pca_clusters_plink.tsv``
+    works as is); samples missing from the file belong to no group.
+    """
+    df = pd.read_csv(groups_path, sep="\t", dtype=str)
+    index = {name: i for i, name in enumerate(samples)}
+    df = df[df["IID"].isin(index)]
+    return {
+        name: np.array([index[iid] for iid in group["IID"]])
+        for name, group in df.groupby(df.columns[-1])
+    }
+
+
+def _maf_and_missing(gts):
+    """Minor allele frequency and missing fraction per row of a gts012 block."""
+    called = gts != UNKNOWN
+    n_called = called.sum(axis=1)
+    alt = np.where(called, gts, 0).sum(axis=1, dtype=np.int64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        af = alt / (2.0 * n_called)
+    return np.minimum(af, 1 - af), 1 - n_called / gts.shape[1]
+
+
+def _info_value(variant, field):
+    if field == "QUAL":
+        value = variant.QUAL
+    else:
+        value = variant.INFO.get(field)
+    if isinstance(value, (list, tuple)):
+        value = value[0] if value else None
+    return np.nan if value is None else float(value)
+
+
+class VariantFilter:
+    """Evaluates parsed predicates over chunks of variants."""
+
+    def __init__(self, predicates, groups=None):
+        self.predicates = predicates
+        self.groups = groups or {}
+        fields = {p.field for p in predicates}
+        self.group_fields = fields & GROUP_FIELDS.keys()
+        self.genotype_fields = fields & GENOTYPE_FIELDS
+        self.info_fields = fields - GROUP_FIELDS.keys() - GENOTYPE_FIELDS
+        if self.group_fields and not self.groups:
+            raise ValueError(
+                f"{', '.join(sorted(self.group_fields))} need sample groups"
+            )
+        self.rejected = {p.text: 0 for p in predicates}
+        self.total = 0
+        self.kept = 0
+
+    def columns(self, chunk):
+        """Values of every referenced field for a chunk of variants."""
+        columns = {
+            field: np.array([_info_value(v, field) for v in chunk])
+            for field in self.info_fields
+        }
+        if not (self.genotype_fields or self.group_fields):
+            return columns
+
+        gts = np.array([v.gt_types for v in chunk], dtype=np.int8)
+        if self.genotype_fields:
+            columns["GT_MAF"], columns["GT_MISSING"] = _maf_and_missing(gts)
+        if self.group_fields:
+            stats = [_maf_and_missing(gts[:, idx]) for idx in self.groups.values()]
+            per_group = {
+                "maf": np.stack([maf for maf, _ in stats]),
+                "missing": np.stack([missing for _, missing in stats]),
+            }
+            for field in self.group_fields:
+                stat, reduce = GROUP_FIELDS[field]
+                with np.errstate(invalid="ignore"):
+                    columns[field] = reduce(per_group[stat], axis=0)
+        return columns
+
+    def mask(self, chunk):
+        """Boolean mask of the chunk's variants passing every predicate."""
+        columns = self.columns(chunk)
+        keep = np.ones(len(chunk), dtype=bool)
+        for predicate in self.predicates:
+            passed = predicate.evaluate(columns[predicate.field])
+            self.rejected[predicate.text] += int((~passed).sum())
+            keep &= passed
+        self.total += len(chunk)
+        self.kept += int(keep.sum())
+        return keep
+
+    def report(self):
+        return {
+            "total": self.total,
+            "kept": self.kept,
+            "rejected": self.total - self.kept,
+            "rejected_by_predicate": self.rejected,
+        }
+
+
+def filter_vcf(in_path, out_path, variant_filter, mode="w", chunk_size=10000):
+    """Stream ``in_path`` in chunks and write the passing records unchanged.
+
+    Returns the filter report with the written records' totals under
+    ``counts``.
+    """
+    vcf = VCF(in_path, gts012=True)
+    writer = Writer(out_path, vcf, mode=mode)
+    counts = {"samples": len(vcf.samples)}
+    counts.update(dict.fromkeys(["snps", "indels", "mnps", "others", "variants"], 0))
+
+    def flush(chunk):
+        for variant, keep in zip(chunk, variant_filter.mask(chunk)):
+            if keep:
+                writer.write_record(variant)
+                counts[TYPE_COUNTS.get(variant.var_type, "others")] += 1
+                counts["variants"] += 1
+
+    chunk = []
+    for variant in vcf:
+        chunk.append(variant)
+        if len(chunk) == chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+
+    writer.close()
+    vcf.close()
+    return {**variant_filter.report(), "counts": counts}
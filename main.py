@@ -1,20 +1,49 @@
 #!/usr/bin/env python3
 import os
 import sys
+import importlib
 import subprocess
+from pathlib import Path
 from dotenv import load_dotenv
+from core.intermediate import DATA_FILES, intermediate_format
+from core.pipeline import (
+    RunReport,
+    Step,
+    StepCache,
+    StepFailed,
+    run_graph,
+    run_in_process,
+)
 
 load_dotenv(".env")
 
 # --- Configuration & Environment ---
 SKIP_PROFILE = os.environ.get("SKIP_CLUSTER_PROFILE", "").lower() == "true"
 SKIP_MDS = os.environ.get("SKIP_MDS", "").lower() == "true"
+# Skip steps whose inputs, code and config are unchanged since their last run
+USE_CACHE = os.environ.get("PIPELINE_CACHE", "true").lower() == "true"
+# CPU budget shared by concurrently running steps
+PIPELINE_CPUS = int(os.environ.get("PIPELINE_CPUS", 0)) or os.cpu_count()
+# subprocess: one interpreter per step, concurrent by dependency graph
+# inprocess: call each step's run() in this warm process, one at a time
+PIPELINE_MODE = os.environ.get("PIPELINE_MODE", "subprocess").lower()
 PYTHON_EXE = sys.executable
+# data.vcf or data.bcf (+ .csi), handed from merge/filter to later steps
+DATA_FILE = DATA_FILES[intermediate_format(os.environ)]
+# plink binary set converted once from the filtered data
+BFILE = [f"02_filtered/data.{ext}" for ext in ("bed", "bim", "fam")]
+# sample groups for the native filter, hashed so edits rerun step 2
+FILTER_GROUPS = [
+    os.path.abspath(path) for path in [os.environ.get("FILTER_GROUPS", "")] if path
+]
+# native MDS reuses the kinship matrix instead of running plink --cluster
+NATIVE_MDS = os.environ.get("MDS_ENGINE", "plink").lower() == "native"
 
 
 class Logger:
     GREEN = "\033[92m"
     YELLOW = "\033[93m"
+    RED = "\033[91m"
     RESET = "\033[0m"
 
     @staticmethod
@@ -25,22 +54,139 @@ class Logger:
     def skip(msg):
         print(f"{Logger.YELLOW}Skipping: {msg} (per configuration){Logger.RESET}")
 
+    @staticmethod
+    def cached(msg):
+        print(f"{Logger.YELLOW}Skipping: {msg} (unchanged since last run){Logger.RESET}")
+
+    @staticmethod
+    def done(msg, seconds):
+        print(f"{Logger.GREEN}Finished: {msg} ({seconds:.1f}s){Logger.RESET}")
+
+    @staticmethod
+    def error(msg):
+        print(f"{Logger.RED}Failed: {msg}{Logger.RESET}")
+
+
+def start_script(script_name, base_path):
+    return subprocess.Popen([PYTHON_EXE, script_name, base_path])
+
 
-def run_script(script_name, base_path):
-    subprocess.run([PYTHON_EXE, script_name, base_path], check=True)
+def run_step_in_process(script_name, base_path, context):
+    module = importlib.import_module(Path(script_name).stem)
+    module.run(base_path, os.environ, context)
 
 
 # --- Pipeline Definition ---
 
+CLUSTER_ENV = [
+    "CLUSTER_ALGO",
+    "DBSCAN_EPS",
+    "DBSCAN_MIN_SAMPLES",
+    "HDBSCAN_MIN_CLUSTER_SIZE",
+    "HDBSCAN_MIN_SAMPLES",
+    "CLUSTER_LIMIT_PCA",
+    "SKIP_CLUSTER_TOPK_VARIANT_CALCULATION",
+]
+
 PIPELINE = [
-    (99, "Cleaning workspace", "./99_clean.py"),
-    (1, "Merging VCF files", "./01_merge.py"),
-    (2, "Applying filters", "./02_apply_filter.py"),
-    (10, "Calculating kinship", "./10_kinship.py"),
-    (20, "Performing PCA", "./20_pca.py"),
-    (21, "Performing MDS", "./21_mds.py"),
-    (30, "Clustering results", "./30_cluster.py"),
-    (31, "Profile each cluster", "./31_cluster_profile.py"),
+    Step(99, "Cleaning workspace", "./99_clean.py", cache=False),
+    Step(
+        1,
+        "Merging VCF files",
+        "./01_merge.py",
+        inputs=["00_raw_vcf"],
+        outputs=[f"01_merged/{DATA_FILE}"],
+        env=["MISSING_TO_REF", "INTERMEDIATE_FORMAT"],
+        after=[99],
+        # each merge chain is four piped bcftools processes
+        cpus=4 * int(os.environ.get("MERGE_WORKERS", 1)),
+    ),
+    Step(
+        2,
+        "Applying filters",
+        "./02_apply_filter.py",
+        # the groups TSV is read from the working directory, not the base path
+        inputs=[f"01_merged/{DATA_FILE}", *FILTER_GROUPS],
+        outputs=[f"02_filtered/{DATA_FILE}"],
+        env=[
+            "SNP_FILTER",
+            "INTERMEDIATE_FORMAT",
+            "FILTER_ENGINE",
+            "FILTER_GROUPS",
+        ],
+        after=[1],
+    ),
+    Step(
+        5,
+        "Converting to plink binary",
+        "./05_plink_binary.py",
+        inputs=[f"02_filtered/{DATA_FILE}"],
+        # digest of the converted data, checked by filtered_genotypes
+        outputs=[*BFILE, "02_filtered/data.source.json"],
+        after=[2],
+        cpus=int(os.environ.get("PLINK_THREADS", 0)) or 1,
+    ),
+    Step(
+        10,
+        "Calculating kinship",
+        "./10_kinship.py",
+        # the native engine reads the VCF/BCF, plink the binary set
+        inputs=[f"02_filtered/{DATA_FILE}", *BFILE],
+        outputs=["10_kinship/out.mibs.id", "10_kinship/out.kin"],
+        env=["KINSHIP_ENGINE"],
+        after=[5],
+        cpus=2,
+    ),
+    Step(
+        20,
+        "Performing PCA",
+        "./20_pca.py",
+        inputs=BFILE,
+        outputs=["20_pca/out.eigenvec", "20_pca/out.eigenval"],
+        env=[
+            "PCA_COUNT",
+            "PCA_ENGINE",
+            "PCA_OVERSAMPLE",
+            "PCA_POWER_ITERATIONS",
+            "PCA_SEED",
+        ],
+        after=[5],
+        cpus=2,
+    ),
+    Step(
+        21,
+        "Performing MDS",
+        "./21_mds.py",
+        # plink reads the binary set, the native engine the kinship store
+        inputs=["10_kinship/out.kin"] if NATIVE_MDS else BFILE,
+        outputs=["21_mds/out.mds"],
+        env=["PCA_COUNT", "MDS_ENGINE", "MDS_SEED"],
+        after=[10] if NATIVE_MDS else [5],
+        cpus=2,
+    ),
+    Step(
+        30,
+        "Clustering results",
+        "./30_cluster.py",
+        # projected samples are listed in out.eigenvec.projected and left out
+        inputs=[
+            "20_pca/out.eigenvec",
+            "20_pca/out.eigenval",
+            "20_pca/out.eigenvec.projected",
+        ],
+        outputs=["30_cluster/pca_clusters_plink.tsv"],
+        env=CLUSTER_ENV,
+        after=[20],
+    ),
+    Step(
+        31,
+        "Profile each cluster",
+        "./31_cluster_profile.py",
+        inputs=[f"01_merged/{DATA_FILE}", "30_cluster/pca_clusters_plink.tsv"],
+        outputs=["31_cluster_profile/result.json"],
+        after=[1, 30],
+        cpus=int(os.environ.get("CLUSTER_PROFILE_WORKERS", 1)),
+    ),
 ]
 
 
@@ -55,27 +201,79 @@ def main():
     base_path = sys.argv[1]
     requested_step = int(sys.argv[2]) if len(sys.argv) == 3 else None
 
-    valid_steps = {step for step, _, _ in PIPELINE}
+    valid_steps = {step.step_id for step in PIPELINE}
     if requested_step is not None and requested_step not in valid_steps:
         print(f"Invalid step {requested_step}. Valid steps: {sorted(valid_steps)}")
         sys.exit(1)
 
-    for step_id, description, script in PIPELINE:
+    cache = StepCache(base_path) if USE_CACHE else None
+    report = RunReport(base_path)
+    keys = {}
 
-        if requested_step is not None and step_id != requested_step:
-            continue
+    steps = [
+        step
+        for step in PIPELINE
+        if requested_step in (None, step.step_id)
+        # Cleaning would throw away the outputs the cache is keeping
+        and not (step.step_id == 99 and cache and requested_step is None)
+    ]
 
-        Logger.step(description)
+    def prepare(step):
+        Logger.step(step.description)
 
-        if step_id == 21 and SKIP_MDS:
+        if step.step_id == 21 and SKIP_MDS:
             Logger.skip("MDS")
-            continue
+            report.add(step, "skipped")
+            return False
 
-        if step_id == 31 and SKIP_PROFILE:
+        if step.step_id == 31 and SKIP_PROFILE:
             Logger.skip("Cluster profiling")
-            continue
+            report.add(step, "skipped")
+            return False
+
+        if cache and step.cache:
+            key = cache.step_key(step)
+            # An explicitly requested step always reruns
+            if requested_step is None and cache.is_fresh(step, key):
+                Logger.cached(step.description)
+                report.add(step, "cached")
+                return False
+            keys[step.step_id] = key
+
+        return True
+
+    def launch(step):
+        return start_script(step.script, base_path)
 
-        run_script(script, base_path)
+    # data loaded by one in-process step and reused by later ones
+    context = {}
+
+    def execute(step):
+        run_step_in_process(step.script, base_path, context)
+
+    def finish(step, metrics):
+        Logger.done(step.description, metrics["wall_seconds"])
+        report.add(step, "ran", metrics)
+        if step.step_id in keys:
+            cache.record(step, keys[step.step_id])
+
+    try:
+        if PIPELINE_MODE == "inprocess":
+            run_in_process(steps, prepare, execute, finish)
+        elif PIPELINE_MODE == "subprocess":
+            run_graph(steps, PIPELINE_CPUS, prepare, launch, finish)
+        else:
+            raise ValueError(f"Unknown PIPELINE_MODE: {PIPELINE_MODE}")
+    except StepFailed as e:
+        Logger.error(str(e))
+        report.add(e.step, "failed", e.metrics)
+        sys.exit(1)
+    finally:
+        # nothing to report into if the run failed before creating it
+        if os.path.isdir(base_path):
+            report.write()
+            print()
+            report.print_table()
 
 
 if __name__ == "__main__":
@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
 
 import pandas as pd
-import numpy as np
 import os
 import sys
+from core.kinship import KinshipStore
 
 # ---------------------------
 # Argument Parsing
@@ -16,39 +16,22 @@ BASE_PATH = sys.argv[1]
 sample_name_cli = sys.argv[2] if len(sys.argv) > 2 else None
 sample_name_2_cli = sys.argv[3] if len(sys.argv) > 3 else None
 
-kinship_input = f"{BASE_PATH}/10_kinship/out.mibs"
-kinship_id_input = f"{BASE_PATH}/10_kinship/out.mibs.id"
-
 # ---------------------------
-# Load Kinship matrix
+# Load Kinship matrix (memory-mapped, normalized on access)
 # ---------------------------
-ids = pd.read_csv(kinship_id_input, sep=r"\s+", header=None)
-ids.columns = ["FID", "IID"]
-samples = ids["IID"].tolist()
+store = KinshipStore.open(BASE_PATH)
+samples = store.iids
 n = len(samples)
 
-triangular_matrix = np.loadtxt(kinship_input)
-kinship_matrix = np.zeros((n, n))
-for i in range(n):
-    kinship_matrix[i, : i + 1] = triangular_matrix[i, : i + 1]
-    kinship_matrix[: i + 1, i] = triangular_matrix[i, : i + 1]
-
-# ---------------------------
-# Normalize kinship values
-# ---------------------------
-min_k = kinship_matrix.min()
-max_k = kinship_matrix.max()
-kinship_matrix = (kinship_matrix - min_k) / (max_k - min_k)
-
 
 # ---------------------------
 # Function to get kinship values for a sample (One vs All)
 # ---------------------------
 def kinship_for_sample(sample_name):
-    if sample_name not in samples:
+    if sample_name not in store.index:
         raise ValueError(f"Sample '{sample_name}' not found in kinship data.")
-    idx = samples.index(sample_name)
-    kin_values = kinship_matrix[idx, :]
+    idx = store.index[sample_name]
+    kin_values = store.row(idx)
     result = (
         pd.DataFrame({"IID": samples, "Kinship": kin_values})
         .sort_values(by="Kinship", ascending=False)
@@ -61,15 +44,15 @@ def kinship_for_sample(sample_name):
 # Function to get pairwise kinship (One vs One)
 # ---------------------------
 def kinship_pair(sample_1, sample_2):
-    if sample_1 not in samples:
+    if sample_1 not in store.index:
         raise ValueError(f"Sample '{sample_1}' not found in kinship data.")
-    if sample_2 not in samples:
+    if sample_2 not in store.index:
         raise ValueError(f"Sample '{sample_2}' not found in kinship data.")
 
-    idx1 = samples.index(sample_1)
-    idx2 = samples.index(sample_2)
+    idx1 = store.index[sample_1]
+    idx2 = store.index[sample_2]
 
-    val = kinship_matrix[idx1, idx2]
+    val = store.value(idx1, idx2)
     return pd.DataFrame(
         {"Sample_1": [sample_1], "Sample_2": [sample_2], "Kinship": [val]}
     )
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import numpy as np
+from core.kinship import KinshipStore
+
+# ---------------------------
+# Argument Parsing
+# ---------------------------
+if len(sys.argv) < 2:
+    print(f"Usage: {os.path.basename(sys.argv[0])} <base_path> [port]")
+    sys.exit(1)
+
+BASE_PATH = sys.argv[1]
+HOST = os.environ.get("KINSHIP_SERVER_HOST", "127.0.0.1")
+PORT = int(sys.argv[2]) if len(sys.argv) > 2 else 8765
+
+# ---------------------------
+# Load Kinship matrix once (memory-mapped, normalized on access)
+# ---------------------------
+store = KinshipStore.open(BASE_PATH)
+
+
+def sample_index(sample_name):
+    if sample_name not in store.index:
+        raise KeyError(f"Sample '{sample_name}' not found in kinship data.")
+    return store.index[sample_name]
+
+
+def json_value(value):
+    """NaN (pairs without shared calls) is not valid JSON; send null."""
+    return None if np.isnan(value) else float(value)
+
+
+def kinship_for_sample(sample_name, limit=None):
+    """One vs all, sorted by descending kinship."""
+    if limit is not None and limit < 0:
+        raise ValueError(f"limit must not be negative: {limit}")
+    kin_values = store.row(sample_index(sample_name))
+    order = np.argsort(-kin_values, kind="stable")[:limit]
+    return [
+        {"IID": store.iids[i], "Kinship": json_value(kin_values[i])} for i in order
+    ]
+
+
+def kinship_pair(sample_1, sample_2):
+    """One vs one."""
+    val = store.value(sample_index(sample_1), sample_index(sample_2))
+    return {"Sample_1": sample_1, "Sample_2": sample_2, "Kinship": json_value(val)}
+
+
+def kinship_batch(request):
+    """Several lookups in one round trip: {"samples": [...], "pairs": [[a, b], ...]}."""
+    limit = request.get("limit")
+    for key in ("samples", "pairs"):
+        if not isinstance(request.get(key, []), list):
+            raise ValueError(f'"{key}" must be a list')
+    return {
+        "samples": {
+            name: kinship_for_sample(name, limit) for name in request.get("samples", [])
+        },
+        "pairs": [kinship_pair(a, b) for a, b in request.get("pairs", [])],
+    }
+
+
+# ---------------------------
+# HTTP endpoints
+#   GET  /sample/<IID>[?limit=N]
+#   GET  /pair/<IID1>/<IID2>
+#   POST /batch
+# ---------------------------
+class KinshipHandler(BaseHTTPRequestHandler):
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_lookup(self, lookup):
+        try:
+            self.reply(200, lookup())
+        except KeyError as e:
+            self.reply(404, {"error": e.args[0]})
+        except (ValueError, TypeError) as e:
+            self.reply(400, {"error": str(e)})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [unquote(p) for p in url.path.strip("/").split("/")]
+        query = parse_qs(url.query)
+
+        if len(parts) == 2 and parts[0] == "sample":
+            # parsed inside the lookup so a bad limit is a 400 reply
+            self.handle_lookup(
+                lambda: kinship_for_sample(
+                    parts[1], int(query["limit"][0]) if "limit" in query else None
+                )
+            )
+        elif len(parts) == 3 and parts[0] == "pair":
+            self.handle_lookup(lambda: kinship_pair(parts[1], parts[2]))
+        else:
+            self.reply(404, {"error": f"Unknown endpoint: {url.path}"})
+
+    def do_POST(self):
+        if urlparse(self.path).path.strip("/") != "batch":
+            self.reply(404, {"error": f"Unknown endpoint: {self.path}"})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError as e:
+            self.reply(400, {"error": str(e)})
+            return
+        if not isinstance(request, dict):
+            self.reply(400, {"error": "Batch request must be a JSON object"})
+            return
+        self.handle_lookup(lambda: kinship_batch(request))
+
+    def log_message(self, format, *args):
+        pass
+
+
+server = ThreadingHTTPServer((HOST, PORT), KinshipHandler)
+print(f"Serving kinship for {len(store)} samples on http://{HOST}:{PORT}")
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    server.server_close()
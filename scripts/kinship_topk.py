@@ -1,63 +1,52 @@
 import pandas as pd
-import numpy as np
 import os
 import sys
+from core.kinship import KinshipStore, extreme_pairs
 
 # ---------------------------
 # Argument Parsing
 # ---------------------------
 if len(sys.argv) < 2:
-    print(f"Usage: {os.path.basename(sys.argv[0])} <base_path>")
+    print(f"Usage: {os.path.basename(sys.argv[0])} <base_path> [k] [block_rows]")
     sys.exit(1)
 
 BASE_PATH = sys.argv[1]
+K = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+BLOCK_ROWS = int(sys.argv[3]) if len(sys.argv) > 3 else 256
 
 # ---------------------------
-# File Paths
+# Load Kinship matrix (memory-mapped)
 # ---------------------------
-kinship_input = f"{BASE_PATH}/10_kinship/out.mibs"
-kinship_id_input = f"{BASE_PATH}/10_kinship/out.mibs.id"
-
-# ---------------------------
-# Load Kinship matrix
-# ---------------------------
-ids = pd.read_csv(kinship_id_input, sep=r"\s+", header=None)
-ids.columns = ["FID", "IID"]
-samples = ids["IID"].tolist()
+store = KinshipStore.open(BASE_PATH)
+samples = store.iids
 n = len(samples)
-
-triangular_matrix = np.loadtxt(kinship_input)
-kinship_matrix = np.zeros((n, n))
-for i in range(n):
-    kinship_matrix[i, : i + 1] = triangular_matrix[i, : i + 1]
-    kinship_matrix[: i + 1, i] = triangular_matrix[i, : i + 1]
+n_pairs = n * (n - 1) // 2
 
 # ---------------------------
-# Normalize kinship values
+# Extract extreme pairs block by block over the upper triangle
 # ---------------------------
-min_k = kinship_matrix.min()
-max_k = kinship_matrix.max()
-kinship_matrix = (kinship_matrix - min_k) / (max_k - min_k)
+top, bottom = extreme_pairs(store.matrix, k=K, block_rows=BLOCK_ROWS)
 
-# ---------------------------
-# Create pairs
-# ---------------------------
-pairs = []
-for i in range(n):
-    for j in range(i + 1, n):
-        pairs.append((samples[i], samples[j], kinship_matrix[i, j]))
 
-df_pairs = (
-    pd.DataFrame(pairs, columns=["IID1", "IID2", "Kinship"])
-    .sort_values(by="Kinship", ascending=False)
-    .reset_index(drop=True)
-)
+def to_frame(pairs, first_rank):
+    rows, cols, values = pairs
+    return pd.DataFrame(
+        {
+            "IID1": [samples[i] for i in rows],
+            "IID2": [samples[j] for j in cols],
+            # normalization is monotonic, so it can wait until here
+            "Kinship": store.scale(values),
+        },
+        index=range(first_rank, first_rank + len(values)),
+    )
+
 
-top10 = df_pairs.head(10)
-bottom10 = df_pairs.tail(10)
+# ranks match a full descending sort of all pairs
+top_k = to_frame(top, 0)
+bottom_k = to_frame(bottom, n_pairs - len(bottom[2]))
 
-print("Top 10 highest-kinship pairs:")
-print(top10)
+print(f"Top {K} highest-kinship pairs:")
+print(top_k)
 
-print("\nTop 10 lowest-kinship pairs:")
-print(bottom10)
+print(f"\nTop {K} lowest-kinship pairs:")
+print(bottom_k)
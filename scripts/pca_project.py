@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from core.intermediate import filtered_genotypes
+from core.pca import (
+    MODEL_SUFFIX,
+    PROJECTED_SUFFIX,
+    GenotypeSource,
+    fit_projection_model,
+    project_samples,
+)
+
+# ---------------------------
+# Argument Parsing
+# ---------------------------
+if len(sys.argv) < 3:
+    print(f"Usage: {os.path.basename(sys.argv[0])} <base_path> <new_samples.vcf>")
+    sys.exit(1)
+
+BASE_PATH = sys.argv[1]
+NEW_VCF = sys.argv[2]
+
+PCA_PREFIX = f"{BASE_PATH}/20_pca/out"
+CLUSTER_DIR = f"{BASE_PATH}/30_cluster"
+
+CLUSTER_ALGO = os.getenv("CLUSTER_ALGO", "hdbscan").lower()
+DBSCAN_EPS = float(os.getenv("DBSCAN_EPS", 0.5))
+CLUSTER_LIMIT_PCA = int(os.getenv("CLUSTER_LIMIT_PCA", 0))
+
+ID_TYPES = {"FID": str, "IID": str}
+
+eigenvec = pd.read_csv(f"{PCA_PREFIX}.eigenvec", sep=r"\s+", dtype=ID_TYPES)
+pca_columns = [col for col in eigenvec.columns if col.startswith("PC")]
+
+# ---------------------------
+# Projection model (reference frequencies + per-PC scale), built once
+# ---------------------------
+if not os.path.exists(f"{PCA_PREFIX}{MODEL_SUFFIX}"):
+    print("No projection model yet, fitting it from the reference genotypes...")
+    source = GenotypeSource(filtered_genotypes(BASE_PATH, os.environ))
+    reference = eigenvec.set_index(["FID", "IID"]).loc[source.ids, pca_columns]
+    fit_projection_model(source, PCA_PREFIX, reference.to_numpy())
+
+# ---------------------------
+# Project the new samples, leaving reference rows untouched
+# ---------------------------
+ids, coords, matched = project_samples(NEW_VCF, PCA_PREFIX)
+print(f"Projected {len(ids)} samples using {matched} matching variants")
+
+known = set(zip(eigenvec["FID"], eigenvec["IID"]))
+new = [i for i, sample in enumerate(ids) if sample not in known]
+for i in set(range(len(ids))) - set(new):
+    print(f"[WARN] {ids[i][1]} is already in {PCA_PREFIX}.eigenvec, skipping")
+
+if not new:
+    sys.exit(0)
+
+with open(f"{PCA_PREFIX}.eigenvec", "a") as f:
+    for i in new:
+        f.write(" ".join([*ids[i], *(f"{v:.6g}" for v in coords[i])]) + "\n")
+
+# 30_cluster leaves these rows out, so reclustering after a projection
+# still sees only the reference samples
+with open(f"{PCA_PREFIX}{PROJECTED_SUFFIX}", "a") as f:
+    for i in new:
+        f.write(" ".join(ids[i]) + "\n")
+
+# ---------------------------
+# Assign to the existing clusters
+# ---------------------------
+# Same feature space as 30_cluster.py: PCs standardized with the
+# reference samples' mean/std, weighted by eigenvalue. A new sample
+# takes the cluster of its nearest reference sample; with DBSCAN it is
+# an outlier unless that sample is within DBSCAN_EPS.
+clusters = pd.read_csv(f"{CLUSTER_DIR}/pca_clusters.tsv", sep="\t", dtype=ID_TYPES)
+columns = pca_columns[:CLUSTER_LIMIT_PCA] if CLUSTER_LIMIT_PCA else pca_columns
+eigenvalues = np.loadtxt(f"{PCA_PREFIX}.eigenval")[: len(columns)]
+
+reference = clusters[columns].to_numpy()
+mean, std = reference.mean(axis=0), reference.std(axis=0)
+std[std == 0] = 1
+
+
+def features(x):
+    return (x - mean) / std * eigenvalues
+
+
+distances = np.linalg.norm(
+    features(coords[new][:, : len(columns)])[:, None, :]
+    - features(reference)[None, :, :],
+    axis=2,
+)
+nearest = distances.argmin(axis=1)
+labels = clusters["Cluster"].to_numpy()[nearest]
+nearest_distance = distances[np.arange(len(new)), nearest]
+if CLUSTER_ALGO == "dbscan":
+    labels = np.where(nearest_distance <= DBSCAN_EPS, labels, "Outlier")
+
+assigned = pd.DataFrame(
+    {
+        "FID": [ids[i][0] for i in new],
+        "IID": [ids[i][1] for i in new],
+        "Cluster": labels,
+        "Distance": nearest_distance,
+    }
+)
+out_path = f"{CLUSTER_DIR}/projected_clusters.tsv"
+assigned.to_csv(
+    out_path, sep="\t", index=False, mode="a", header=not os.path.exists(out_path)
+)
+
+print(assigned.to_string(index=False))